@@ -2,14 +2,21 @@
 Agent模块包，包含各种智能代理功能
 """
 
-from .agent_base import detect_and_execute_agent_task, detect_task_with_llm
-from .weather_agent import WeatherAgent
-from .news_agent import NewsAgent
-from .search_agent import SearchAgent
-from .calculation_agent import CalculationAgent
-from .translation_agent import TranslationAgent
-from .reminder_agent import ReminderAgent
-from .time_parser import parse_time_with_llm, parse_time_from_message
+import importlib
+
+# 导出名称到所在子模块的映射，首次访问时才导入对应模块
+_LAZY = {
+    'detect_and_execute_agent_task': 'agent_base',
+    'detect_task_with_llm': 'agent_base',
+    'WeatherAgent': 'weather_agent',
+    'NewsAgent': 'news_agent',
+    'SearchAgent': 'search_agent',
+    'CalculationAgent': 'calculation_agent',
+    'TranslationAgent': 'translation_agent',
+    'ReminderAgent': 'reminder_agent',
+    'parse_time_with_llm': 'time_parser',
+    'parse_time_from_message': 'time_parser'
+}
 
 __all__ = [
     'detect_and_execute_agent_task',
@@ -22,4 +29,17 @@ __all__ = [
     'ReminderAgent',
     'parse_time_with_llm',
     'parse_time_from_message'
-] 
\ No newline at end of file
+]
+
+def __getattr__(name):
+    """按需导入子模块中的导出对象（PEP 562）"""
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module = importlib.import_module(f".{_LAZY[name]}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -4,13 +4,142 @@ Agent基础模块，包含智能代理的核心功能
 
 import re
 import json
+import string
+import hashlib
+import functools
 import logging
+from contextvars import ContextVar
 from datetime import datetime
-import requests
+from .http_client import chat_completion, loads
+from .cache import TTLCache, normalize_key
+from .weather_agent import WeatherAgent
+from .news_agent import NewsAgent
+from .search_agent import SearchAgent
+from .calculation_agent import CalculationAgent
+from .translation_agent import TranslationAgent
+from .reminder_agent import ReminderAgent
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 预编译的正则表达式
+_CURRENCY_RE = re.compile(r'([\d.]+)\s*([^\d\s]+)\s*(?:兑换|转换|换成|等于|是多少)\s*([^\d\s]+)')
+# 天气/新闻查询模式，命名分组在识别的同时提取城市/类别，一次扫描完成
+_WEATHER_RE = re.compile(
+    r'(?:查询|查看|获取|告诉我|今天|明天|后天).*?'
+    r'(?:(?P<city>[\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县)(?=.*?(?:天气|气温|温度)))?'
+    r'.*?(?:天气|气温|温度|下雨|下雪)'
+)
+_NEWS_RE = re.compile(r'(?:查询|查看|获取|告诉我|最新|今日|今天).*?(?P<category>[\u4e00-\u9fa5]{2,})?(?:新闻|资讯|热点)')
+# 城市/类别出现在触发词之前时的兜底提取
+_CITY_RE = re.compile(r'([\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县).*?(?:天气|气温|温度)')
+_CATEGORY_RE = re.compile(r'([\u4e00-\u9fa5]{2,})(?:新闻|资讯|热点)')
+_FINANCIAL_RE = re.compile(r'(股票|股价|汇率|比特币|加密货币|数字货币).*?(价格|行情|走势|多少|是多少)')
+_FENCED_JSON_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+# 实时性查询模式，合并为一个带命名分组的正则，一次扫描即可完成分类
+_REALTIME_RE = re.compile('|'.join(f'(?P<{task_type}>{pattern})' for task_type, pattern in [
+    ("weather", r'(?:今天|明天|后天|最近|现在).*?(?:天气|气温|温度|下雨|下雪)'),
+    ("news", r'(?:最新|今日|今天|实时).*?(?:新闻|资讯|热点)'),
+    ("search", '|'.join([
+        r'(?:股票|股价|汇率|比特币|加密货币|数字货币).*?(?:价格|行情|走势|多少|是多少)',
+        r'(?:疫情|病例|确诊).*?(?:数据|情况|统计)',
+        r'(?:交通|路况|拥堵|堵车).*?(?:情况|状态)',
+        r'(?:航班|火车|高铁).*?(?:状态|延误|取消)',
+        r'(?:体育|比赛|足球|篮球|赛事).*?(?:比分|结果|赛程)',
+        r'(?:电影|电视剧|综艺).*?(?:评分|上映|播出)',
+        r'(?:餐厅|美食|饭店).*?(?:推荐|评价|地址)',
+        r'(?:地址|位置|怎么走|路线).*?(?:在哪|如何到达)'
+    ]))
+]))
+
+# 实时性查询模式末尾的触发名词，消息中不含任何触发名词时必然不匹配_REALTIME_RE，可跳过整个正则扫描
+_REALTIME_TRIGGER_RE = re.compile('|'.join(map(re.escape, [
+    "天气", "气温", "温度", "下雨", "下雪",
+    "新闻", "资讯", "热点",
+    "价格", "行情", "走势", "多少", "数据", "情况", "统计", "状态", "延误", "取消",
+    "比分", "结果", "赛程", "评分", "上映", "播出", "推荐", "评价", "地址", "在哪", "如何到达"
+])))
+
+# 常见的搜索词
+_SEARCH_KEYWORDS_RE = re.compile('|'.join(map(re.escape, [
+    "搜索", "查询", "查找", "了解", "知道", "告诉我", "是什么", "怎么样", "如何", "多少"
+])))
+
+# 当前正在处理的联系人，由调用方在分发任务前设置；调用时contact传None则从这里读取
+CURRENT_CONTACT = ContextVar("contact", default=None)
+
+# 任务识别结果缓存，以及区分"未缓存"与"缓存了None"的哨兵
+_TASK_CACHE = TTLCache(maxsize=2048, ttl=300)
+_MISSING = object()
+
+# 汇率换算指令，要求一次返回汇率和换算结果
+_CURRENCY_SYS_PROMPT = """你是一个汇率换算助手。用户会提供金额、源货币和目标货币，以及当前时间。
+请根据你所知的最新汇率完成换算，只返回如下JSON，不要包含其他内容：
+{"rate": 1源货币兑换目标货币的汇率（数字）, "converted": 换算后的金额（数字）, "source": "汇率来源或时间说明"}"""
+
+# 货币名称映射
+_CURRENCY_MAP = {
+    "人民币": "CNY",
+    "rmb": "CNY",
+    "cny": "CNY",
+    "元": "CNY",
+    "美元": "USD",
+    "美金": "USD",
+    "usd": "USD",
+    "刀": "USD",
+    "欧元": "EUR",
+    "eur": "EUR",
+    "英镑": "GBP",
+    "gbp": "GBP",
+    "日元": "JPY",
+    "jpy": "JPY",
+    "韩元": "KRW",
+    "krw": "KRW",
+    "港币": "HKD",
+    "港元": "HKD",
+    "hkd": "HKD",
+    "澳元": "AUD",
+    "aud": "AUD",
+    "加元": "CAD",
+    "cad": "CAD",
+    "新加坡元": "SGD",
+    "sgd": "SGD",
+    "瑞士法郎": "CHF",
+    "chf": "CHF",
+    "泰铢": "THB",
+    "thb": "THB"
+}
+
+# 货币名称规范化转换表：ASCII大写转小写并删除空白，一次translate完成
+_LOWER_STRIP = str.maketrans({
+    **dict.fromkeys(string.whitespace),
+    **{c: c.lower() for c in string.ascii_uppercase}
+})
+
+def extract_json(text):
+    """
+    从大模型响应中提取JSON文本
+    
+    Args:
+        text: 大模型响应
+        
+    Returns:
+        JSON字符串
+    """
+    # 响应本身就是JSON时跳过正则匹配
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        return stripped
+    
+    # 查找JSON部分
+    json_match = _FENCED_JSON_RE.search(text)
+    if json_match:
+        return json_match.group(1)
+    
+    # 尝试直接解析整个响应
+    return text
+
 def execute_agent_task(task_type, params, contact, config):
     """
     执行自动化任务
@@ -22,14 +151,11 @@ def execute_agent_task(task_type, params, contact, config):
     - search: 信息搜索
     - calculate: 计算或转换
     - translate: 翻译
-    """
-    from .weather_agent import WeatherAgent
-    from .news_agent import NewsAgent
-    from .search_agent import SearchAgent
-    from .calculation_agent import CalculationAgent
-    from .translation_agent import TranslationAgent
-    from .reminder_agent import ReminderAgent
     
+    contact为None时使用CURRENT_CONTACT中的联系人
+    """
+    if contact is None:
+        contact = CURRENT_CONTACT.get()
     try:
         if task_type == "weather":
             agent = WeatherAgent(config)
@@ -81,8 +207,7 @@ def detect_compound_task(message):
         复合任务信息或None
     """
     # 汇率转换模式
-    currency_pattern = r'([\d.]+)\s*([^\d\s]+)\s*(?:兑换|转换|换成|等于|是多少)\s*([^\d\s]+)'
-    currency_match = re.search(currency_pattern, message)
+    currency_match = _CURRENCY_RE.search(message)
     
     if currency_match:
         amount = float(currency_match.group(1))
@@ -113,44 +238,11 @@ def normalize_currency(currency_name):
     Returns:
         标准化后的货币名称
     """
-    # 货币名称映射
-    currency_map = {
-        "人民币": "CNY",
-        "rmb": "CNY",
-        "cny": "CNY",
-        "元": "CNY",
-        "美元": "USD",
-        "美金": "USD",
-        "usd": "USD",
-        "刀": "USD",
-        "欧元": "EUR",
-        "eur": "EUR",
-        "英镑": "GBP",
-        "gbp": "GBP",
-        "日元": "JPY",
-        "jpy": "JPY",
-        "韩元": "KRW",
-        "krw": "KRW",
-        "港币": "HKD",
-        "港元": "HKD",
-        "hkd": "HKD",
-        "澳元": "AUD",
-        "aud": "AUD",
-        "加元": "CAD",
-        "cad": "CAD",
-        "新加坡元": "SGD",
-        "sgd": "SGD",
-        "瑞士法郎": "CHF",
-        "chf": "CHF",
-        "泰铢": "THB",
-        "thb": "THB"
-    }
-    
     # 转为小写并去除空格
-    normalized = currency_name.lower().strip()
+    normalized = currency_name.translate(_LOWER_STRIP)
     
     # 查找映射
-    return currency_map.get(normalized, normalized)
+    return _CURRENCY_MAP.get(normalized, normalized)
 
 def execute_compound_task(task_info, contact, config):
     """
@@ -163,9 +255,6 @@ def execute_compound_task(task_info, contact, config):
     Returns:
         执行结果
     """
-    from .search_agent import SearchAgent
-    from .calculation_agent import CalculationAgent
-    
     try:
         if task_info["type"] == "currency_conversion":
             # 汇率转换
@@ -173,7 +262,12 @@ def execute_compound_task(task_info, contact, config):
             from_currency = task_info["from_currency"]
             to_currency = task_info["to_currency"]
             
-            # 先搜索汇率
+            # 先尝试一次调用同时获取汇率并换算
+            result = convert_currency_with_llm(amount, from_currency, to_currency, config)
+            if result:
+                return result
+            
+            # 结果无效时退回先搜索汇率、再计算的两步流程
             search_agent = SearchAgent(config)
             search_query = f"{from_currency}兑{to_currency}汇率"
             search_result = search_agent.search(search_query)
@@ -189,91 +283,163 @@ def execute_compound_task(task_info, contact, config):
         logger.error(f"执行复合任务时出错: {str(e)}")
         return f"执行复合任务时出错: {str(e)}"
 
+def convert_currency_with_llm(amount, from_currency, to_currency, config):
+    """
+    通过一次大模型调用获取汇率并完成换算
+    
+    Args:
+        amount: 金额
+        from_currency: 源货币
+        to_currency: 目标货币
+        config: 配置对象
+        
+    Returns:
+        换算结果文本，结果无效时返回None
+    """
+    try:
+        current_time_str = datetime.now().strftime("%Y年%m月%d日 %H:%M")
+        ai_response = chat_completion(config, [
+            {"role": "system", "content": f"{config.system_prompt}\n\n{_CURRENCY_SYS_PROMPT}"},
+            {"role": "user", "content": f"金额: {amount}\n源货币: {from_currency}\n目标货币: {to_currency}\n当前时间: {current_time_str}"}
+        ], 0.3, cache_ttl=60)
+        
+        result = loads(extract_json(ai_response))
+        rate = float(result["rate"])
+        converted = float(result["converted"])
+        
+        # 校验换算结果与汇率是否一致
+        if rate <= 0 or abs(converted - amount * rate) > max(0.01, abs(converted) * 0.01):
+            logger.warning(f"[agent_base] 汇率换算结果不一致: {result}")
+            return None
+        
+        source = result.get("source") or current_time_str
+        return (f"计算结果：\n{amount:g} {from_currency} ≈ {converted:,.2f} {to_currency}\n"
+                f"汇率：1 {from_currency} = {rate:g} {to_currency}（{source}）")
+        
+    except Exception as e:
+        logger.error(f"[agent_base] 单次调用汇率换算失败: {str(e)}")
+        return None
+
 def detect_and_execute_agent_task(message, contact, config):
     """
-    识别并执行自动任务
+    识别并执行自动任务，contact为None时使用CURRENT_CONTACT中的联系人
     """
+    if contact is None:
+        contact = CURRENT_CONTACT.get()
     logger.info(f"[agent_base] 开始识别并执行自动任务: {message}, 联系人: {contact}")
     
+    # 规则识别的结果只取决于消息内容，重复的消息直接复用
+    rule_task = detect_task_by_rules(message)
+    if rule_task:
+        task_kind, task_arg = rule_task
+        
+        # 复合任务（先搜索后计算）
+        if task_kind == "compound":
+            compound_task = dict(task_arg)
+            logger.info(f"[agent_base] 检测到复合任务: {compound_task}")
+            return execute_compound_task(compound_task, contact, config)
+        
+        # 网络搜索请求
+        if task_kind == "search":
+            logger.info(f"[agent_base] 检测到网络搜索请求: '{task_arg}'")
+            
+            # 检查搜索内容是否为空
+            if not task_arg:
+                logger.warning("[agent_base] 搜索内容为空")
+                return "搜索内容不能为空，请在/g后输入要搜索的内容"
+                
+            # 创建搜索代理并执行搜索
+            try:
+                logger.info(f"[agent_base] 创建SearchAgent实例并执行搜索: '{task_arg}'")
+                search_agent = SearchAgent(config)
+                # 使用search方法，保持与SearchAgent中的处理逻辑一致
+                return search_agent.search(message)
+            except Exception as e:
+                logger.error(f"[agent_base] 执行搜索时出错: {str(e)}")
+                return f"搜索失败: {str(e)}"
+        
+        # 天气查询
+        if task_kind == "weather":
+            logger.info(f"[agent_base] 检测到天气查询请求，城市: {task_arg}")
+            weather_agent = WeatherAgent(config)
+            return weather_agent.get_weather(task_arg)
+        
+        # 新闻查询
+        if task_kind == "news":
+            news_agent = NewsAgent(config)
+            return news_agent.get_news(task_arg)
+        
+        # 股票和汇率查询，直接执行搜索
+        if task_kind == "financial":
+            search_agent = SearchAgent(config)
+            return search_agent.search(message)
+        
+        # 简单计算表达式
+        if task_kind == "calculate":
+            calc_agent = CalculationAgent(config)
+            return calc_agent.calculate(message)
+    
+    # 如果规则无法识别，尝试使用大模型识别任务
+    task_info = detect_task_with_llm(message, contact, config)
+    if task_info:
+        task_type = task_info.get("task_type")
+        params = task_info.get("params", {})
+        
+        if task_type:
+            return execute_agent_task(task_type, params, contact, config)
+    
+    # 提醒设置模式已在process_message中处理
+    return None
+
+@functools.lru_cache(maxsize=2048)
+def detect_task_by_rules(message):
+    """
+    按规则识别消息中的任务，只识别不执行；结果只取决于消息内容，按消息缓存
+    
+    Args:
+        message: 用户消息
+        
+    Returns:
+        (任务类型, 任务参数)元组或None；任务参数为不可变对象，可安全地在多次调用间共享
+    """
     # 检查是否是复合任务（先搜索后计算）
     compound_task = detect_compound_task(message)
     if compound_task:
-        logger.info(f"[agent_base] 检测到复合任务: {compound_task}")
-        return execute_compound_task(compound_task, contact, config)
+        return ("compound", tuple(compound_task.items()))
     
     # 检查是否是网络搜索请求
     if message.startswith("/g "):
-        search_content = message[3:].strip()
-        logger.info(f"[agent_base] 检测到网络搜索请求: '{search_content}'")
-        
-        # 检查搜索内容是否为空
-        if not search_content:
-            logger.warning("[agent_base] 搜索内容为空")
-            return "搜索内容不能为空，请在/g后输入要搜索的内容"
-            
-        # 创建搜索代理并执行搜索
-        try:
-            logger.info(f"[agent_base] 创建SearchAgent实例并执行搜索: '{search_content}'")
-            from .search_agent import SearchAgent
-            search_agent = SearchAgent(config)
-            # 使用search方法，保持与SearchAgent中的处理逻辑一致
-            return search_agent.search(message)
-        except Exception as e:
-            logger.error(f"[agent_base] 执行搜索时出错: {str(e)}")
-            return f"搜索失败: {str(e)}"
+        return ("search", message[3:].strip())
     
     # 检查是否是实时性强的查询
     # 天气查询模式
-    weather_pattern = r'(查询|查看|获取|告诉我|今天|明天|后天).*?(?:天气|气温|温度|下雨|下雪)'
-    if re.search(weather_pattern, message):
+    weather_match = _WEATHER_RE.search(message)
+    if weather_match:
         # 提取城市
-        city_pattern = r'([\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县).*?(?:天气|气温|温度)'
-        city_match = re.search(city_pattern, message)
-        city = city_match.group(1) if city_match else "北京"
-        
-        logger.info(f"[agent_base] 检测到天气查询请求，城市: {city}")
-        # 构建搜索查询并直接执行
-        from .weather_agent import WeatherAgent
-        weather_agent = WeatherAgent(config)
-        return weather_agent.get_weather(city)
+        city = weather_match.group("city")
+        if not city:
+            city_match = _CITY_RE.search(message)
+            city = city_match.group(1) if city_match else "北京"
+        return ("weather", city)
     
     # 新闻查询模式
-    news_pattern = r'(查询|查看|获取|告诉我|最新|今日|今天).*?(?:新闻|资讯|热点)'
-    if re.search(news_pattern, message):
+    news_match = _NEWS_RE.search(message)
+    if news_match:
         # 提取类别
-        category_pattern = r'([\u4e00-\u9fa5]{2,})(?:新闻|资讯|热点)'
-        category_match = re.search(category_pattern, message)
-        category = category_match.group(1) if category_match else "综合"
-        
-        # 构建搜索查询并直接执行
-        from .news_agent import NewsAgent
-        news_agent = NewsAgent(config)
-        return news_agent.get_news(category)
+        category = news_match.group("category")
+        if not category:
+            category_match = _CATEGORY_RE.search(message)
+            category = category_match.group(1) if category_match else "综合"
+        return ("news", category)
     
     # 股票和汇率查询模式
-    financial_pattern = r'(股票|股价|汇率|比特币|加密货币|数字货币).*?(价格|行情|走势|多少|是多少)'
-    if re.search(financial_pattern, message):
-        # 直接执行搜索
-        from .search_agent import SearchAgent
-        search_agent = SearchAgent(config)
-        return search_agent.search(message)
+    if _FINANCIAL_RE.search(message):
+        return ("financial", None)
     
     # 检查是否是简单计算表达式
-    from .calculation_agent import CalculationAgent
-    calc_agent = CalculationAgent(config)
-    if calc_agent.is_simple_math_expression(message):
-        return calc_agent.calculate(message)
+    if CalculationAgent.is_simple_math_expression(message):
+        return ("calculate", None)
     
-    # 如果规则无法识别，尝试使用大模型识别任务
-    task_info = detect_task_with_llm(message, contact, config)
-    if task_info:
-        task_type = task_info.get("task_type")
-        params = task_info.get("params", {})
-        
-        if task_type:
-            return execute_agent_task(task_type, params, contact, config)
-    
-    # 提醒设置模式已在process_message中处理
     return None
 
 def detect_task_with_llm(message, contact, config):
@@ -288,56 +454,69 @@ def detect_task_with_llm(message, contact, config):
     Returns:
         任务信息字典或None
     """
+    # 按模型和规范化后的消息查询缓存，仅有空白、全半角或句末标点差别的消息共用结果；未识别到任务的结果（None）同样缓存
+    # 识别结果的参数中带有消息原文，因此不统一大小写
+    cache_key = hashlib.blake2b(f"{config.model_name}\0{normalize_key(message, casefold=False)}".encode("utf-8"),
+                                digest_size=16).hexdigest()
+    cached = _TASK_CACHE.get(cache_key, _MISSING)
+    if cached is not _MISSING:
+        logger.info(f"[agent_base] 命中任务识别缓存: {message} -> {cached}")
+        return cached
+    
     try:
-        logger.info(f"[agent_base] 使用LLM识别任务: {message}")
-        # 先检查是否是实时性强的查询
-        realtime_patterns = [
-            (r'(今天|明天|后天|最近|现在).*?(天气|气温|温度|下雨|下雪)', "weather"),
-            (r'(最新|今日|今天|实时).*?(新闻|资讯|热点)', "news"),
-            (r'(股票|股价|汇率|比特币|加密货币|数字货币).*?(价格|行情|走势|多少|是多少)', "search"),
-            (r'(疫情|病例|确诊).*?(数据|情况|统计)', "search"),
-            (r'(交通|路况|拥堵|堵车).*?(情况|状态)', "search"),
-            (r'(航班|火车|高铁).*?(状态|延误|取消)', "search"),
-            (r'(体育|比赛|足球|篮球|赛事).*?(比分|结果|赛程)', "search"),
-            (r'(电影|电视剧|综艺).*?(评分|上映|播出)', "search"),
-            (r'(餐厅|美食|饭店).*?(推荐|评价|地址)', "search"),
-            (r'(地址|位置|怎么走|路线).*?(在哪|如何到达)', "search")
-        ]
+        result = _classify_task(message, config)
+    except Exception as e:
+        logger.error(f"使用LLM识别任务时出错: {str(e)}")
+        return None
+    
+    _TASK_CACHE.set(cache_key, result)
+    return result
+
+def _classify_task(message, config):
+    """
+    依次使用规则和大模型识别消息中的任务
+    
+    Args:
+        message: 用户消息
+        config: 配置对象
         
-        for pattern, task_type in realtime_patterns:
-            if re.search(pattern, message):
-                logger.info(f"[agent_base] 检测到实时性查询: {message} -> {task_type}")
-                
-                # 对于天气查询，提取城市
-                if task_type == "weather":
-                    city_pattern = r'([\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县).*?(?:天气|气温|温度)'
-                    city_match = re.search(city_pattern, message)
-                    city = city_match.group(1) if city_match else "北京"
-                    return {"task_type": task_type, "params": {"city": city}, "confidence": 0.9}
-                
-                # 对于新闻查询，提取类别
-                elif task_type == "news":
-                    category_pattern = r'([\u4e00-\u9fa5]{2,})(?:新闻|资讯|热点)'
-                    category_match = re.search(category_pattern, message)
-                    category = category_match.group(1) if category_match else "综合"
-                    return {"task_type": task_type, "params": {"category": category}, "confidence": 0.9}
-                
-                # 对于其他实时查询，直接作为搜索处理
-                else:
-                    return {"task_type": "search", "params": {"query": message}, "confidence": 0.9}
+    Returns:
+        任务信息字典或None
+    """
+    logger.info(f"[agent_base] 使用LLM识别任务: {message}")
+    # 先检查是否是实时性强的查询
+    realtime_match = _REALTIME_TRIGGER_RE.search(message) and _REALTIME_RE.search(message)
+    if realtime_match:
+        task_type = realtime_match.lastgroup
+        logger.info(f"[agent_base] 检测到实时性查询: {message} -> {task_type}")
         
-        # 检查是否包含常见的搜索词
-        search_keywords = ["搜索", "查询", "查找", "了解", "知道", "告诉我", "是什么", "怎么样", "如何", "多少"]
-        if any(keyword in message for keyword in search_keywords):
-            logger.info(f"检测到可能的搜索查询: {message}")
-            return {"task_type": "search", "params": {"query": message}, "confidence": 0.8}
+        # 对于天气查询，提取城市
+        if task_type == "weather":
+            city_match = _CITY_RE.search(message)
+            city = city_match.group(1) if city_match else "北京"
+            return {"task_type": task_type, "params": {"city": city}, "confidence": 0.9}
         
-        # 获取基础系统提示词
-        base_system_prompt = config.system_prompt
-        logger.info(f"[agent_base] 使用基础系统提示词: '{base_system_prompt}'")
+        # 对于新闻查询，提取类别
+        elif task_type == "news":
+            category_match = _CATEGORY_RE.search(message)
+            category = category_match.group(1) if category_match else "综合"
+            return {"task_type": task_type, "params": {"category": category}, "confidence": 0.9}
         
-        # 构建提示
-        system_prompt = f"""{base_system_prompt}
+        # 对于其他实时查询，直接作为搜索处理
+        else:
+            return {"task_type": "search", "params": {"query": message}, "confidence": 0.9}
+
+    # 检查是否包含常见的搜索词
+    if _SEARCH_KEYWORDS_RE.search(message):
+        logger.info(f"检测到可能的搜索查询: {message}")
+        return {"task_type": "search", "params": {"query": message}, "confidence": 0.8}
+    
+    # 获取基础系统提示词
+    base_system_prompt = config.system_prompt
+    logger.info(f"[agent_base] 使用基础系统提示词: '{base_system_prompt}'")
+    
+    # 构建提示
+    system_prompt = f"""{base_system_prompt}
 
 你是一个智能助手，能够识别用户消息中的任务请求。
 请分析用户消息，判断是否包含以下类型的任务请求：
@@ -363,57 +542,31 @@ def detect_task_with_llm(message, contact, config):
 3. confidence: 你对识别结果的置信度（0-1之间的小数）
 
 如果无法识别任何任务，请返回 {"task_type": null, "confidence": 0}"""
+    
+    user_prompt = f"请识别以下消息中的任务请求：{message}"
+    
+    logger.info(f"[agent_base] 完整系统提示词: '{system_prompt}'")
+    
+    # 调用AI模型，识别结果由detect_task_with_llm中的任务识别缓存复用，这里不再缓存响应
+    ai_response = chat_completion(config, [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ], 0.3)
+    logger.info(f"LLM任务识别响应: {ai_response}")
+    
+    # 尝试从响应中提取JSON
+    try:
+        result = loads(extract_json(ai_response))
         
-        user_prompt = f"请识别以下消息中的任务请求：{message}"
-        
-        logger.info(f"[agent_base] 完整系统提示词: '{system_prompt}'")
-        
-        # 调用AI模型
-        headers = {
-            "Authorization": f"Bearer {config.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": config.model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.3
-        }
-        
-        response = requests.post(config.get_full_api_url(), json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        # 解析响应
-        ai_response = response.json()["choices"][0]["message"]["content"]
-        logger.info(f"LLM任务识别响应: {ai_response}")
-        
-        # 尝试从响应中提取JSON
-        try:
-            # 查找JSON部分
-            json_match = re.search(r'```json\s*(.*?)\s*```', ai_response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # 尝试直接解析整个响应
-                json_str = ai_response
-                
-            result = json.loads(json_str)
-            
-            # 检查置信度和任务类型
-            if result.get("confidence", 0) < 0.6 or not result.get("task_type"):
-                logger.info(f"未识别到任务或置信度低: {result}")
-                return None
-                
-            logger.info(f"成功识别任务: {result}")
-            return result
-                
-        except json.JSONDecodeError:
-            logger.error(f"无法从AI响应中解析JSON: {ai_response}")
+        # 检查置信度和任务类型
+        if result.get("confidence", 0) < 0.6 or not result.get("task_type"):
+            logger.info(f"未识别到任务或置信度低: {result}")
             return None
             
-    except Exception as e:
-        logger.error(f"使用LLM识别任务时出错: {str(e)}")
-        return None 
\ No newline at end of file
+        logger.info(f"成功识别任务: {result}")
+        return result
+            
+    except json.JSONDecodeError:
+        logger.error(f"无法从AI响应中解析JSON: {ai_response}")
+        return None
+ 
\ No newline at end of file
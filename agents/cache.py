@@ -0,0 +1,67 @@
+"""
+缓存模块，提供线程安全的带过期时间的LRU缓存
+"""
+
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# 句末可忽略的标点（中英文），只在末尾去除，不影响句中的数字、分隔符和运算符
+_TRAILING_PUNCT = ".!?。！？~～…"
+
+def normalize_key(text, casefold=True):
+    """
+    把消息规范化为缓存键：统一全半角和大小写、合并连续空白、去掉首尾空白和句末标点；
+    数字、分隔符、运算符以及词语中的字符都原样保留，避免含义不同的消息共用缓存
+
+    Args:
+        text: 原始消息
+        casefold: 是否统一大小写；缓存结果中带有原文时应保留大小写
+
+    Returns:
+        规范化后的文本
+    """
+    text = unicodedata.normalize("NFKC", text)
+    if casefold:
+        text = text.casefold()
+    return " ".join(text.split()).rstrip(_TRAILING_PUNCT).rstrip()
+
+class TTLCache:
+    """线程安全的LRU缓存，条目在ttl秒后过期"""
+
+    def __init__(self, maxsize=512, ttl=300):
+        """
+        初始化缓存
+
+        Args:
+            maxsize: 最大条目数，超出时淘汰最久未使用的条目
+            ttl: 默认过期时间（秒）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """获取缓存值，不存在或已过期时返回default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """写入缓存值，ttl为空时使用默认过期时间"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
@@ -2,13 +2,87 @@
 计算代理模块，用于处理计算请求
 """
 
+import ast
+import functools
 import logging
-import requests
+import operator
 import re
+from .http_client import chat_completion, iter_chat_completion
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 简单数学表达式允许的字符
+_VALID_MATH_CHARS = frozenset("0123456789+-*/().^%<>=")
+_DIGITS = frozenset("0123456789")
+
+# 表达式求值允许的运算符
+_SAFE_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+    ast.Mod: operator.mod,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne
+}
+
+# 幂运算指数上限，防止超大整数运算卡死
+_MAX_EXPONENT = 1000
+
+@functools.lru_cache(maxsize=256)
+def _parse_expression(expression):
+    """解析表达式为AST，相同表达式复用解析结果"""
+    return ast.parse(expression, mode="eval").body
+
+def _eval_node(node):
+    """
+    递归计算AST节点，只允许数字和白名单中的运算符
+
+    Args:
+        node: AST节点
+
+    Returns:
+        计算结果
+    """
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _SAFE_OPS:
+        left = _eval_node(node.left)
+        right = _eval_node(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > _MAX_EXPONENT:
+            raise ValueError(f"指数过大: {right}")
+        return _SAFE_OPS[type(node.op)](left, right)
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _SAFE_OPS:
+        return _SAFE_OPS[type(node.op)](_eval_node(node.operand))
+
+    if isinstance(node, ast.Compare) and all(type(op) in _SAFE_OPS for op in node.ops):
+        left = _eval_node(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _eval_node(comparator)
+            if not _SAFE_OPS[type(op)](left, right):
+                return False
+            left = right
+        return True
+
+    raise ValueError(f"不支持的表达式: {ast.dump(node)}")
+
+# 计算指令（静态部分），拼接在基础系统提示词之后
+_CALC_SYS_PROMPT = """你是一个计算助手。用户会提供一个计算表达式或单位转换请求，你需要计算结果。
+请确保计算准确，并清晰地展示计算过程和最终结果。
+对于单位转换，请说明转换关系。
+如果是复杂的实时数据计算（如货币汇率转换），请建议用户先使用"/g 查询汇率"获取最新汇率，然后再进行计算。"""
+
 class CalculationAgent:
     """计算代理，处理各种计算请求"""
     
@@ -46,7 +120,8 @@ class CalculationAgent:
             logger.error(f"执行计算时出错: {str(e)}")
             return f"计算失败: {str(e)}"
     
-    def is_simple_math_expression(self, expression):
+    @staticmethod
+    def is_simple_math_expression(expression):
         """
         判断是否为简单的数学表达式
         
@@ -60,8 +135,8 @@ class CalculationAgent:
         expr = expression.replace(" ", "")
         
         # 检查是否只包含数字、基本运算符和括号
-        valid_chars = set("0123456789+-*/().^%<>=")
-        return all(c in valid_chars for c in expr) and any(c in "0123456789" for c in expr)
+        chars = set(expr)
+        return chars <= _VALID_MATH_CHARS and not chars.isdisjoint(_DIGITS)
     
     def calculate_with_macos(self, expression):
         """
@@ -77,15 +152,40 @@ class CalculationAgent:
             # 替换^为**以支持幂运算
             expression = expression.replace("^", "**")
             
-            # 使用Python的eval进行计算
-            # 注意：在生产环境中应该更加谨慎地使用eval
-            result = eval(expression)
+            # 通过AST白名单求值，避免使用eval
+            result = _eval_node(_parse_expression(expression.strip()))
             
             return result
         except Exception as e:
             logger.error(f"使用macOS计算时出错: {str(e)}")
             return None
     
+    def _build_messages(self, expression):
+        """
+        构建计算请求的消息列表
+        
+        Args:
+            expression: 计算表达式
+            
+        Returns:
+            消息列表
+        """
+        # 获取基础系统提示词
+        base_system_prompt = self.config.system_prompt
+        logger.info(f"[CalculationAgent] 使用基础系统提示词: '{base_system_prompt}'")
+        
+        # 构建提示
+        system_prompt = f"{base_system_prompt}\n\n{_CALC_SYS_PROMPT}"
+        
+        user_prompt = f"计算: {expression}"
+        
+        logger.info(f"[CalculationAgent] 完整系统提示词: '{system_prompt}'")
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
     def calculate_with_llm(self, expression):
         """
         使用大模型执行计算
@@ -97,44 +197,28 @@ class CalculationAgent:
             计算结果
         """
         try:
-            # 获取基础系统提示词
-            base_system_prompt = self.config.system_prompt
-            logger.info(f"[CalculationAgent] 使用基础系统提示词: '{base_system_prompt}'")
-            
-            # 构建提示
-            system_prompt = f"""{base_system_prompt}
-
-你是一个计算助手。用户会提供一个计算表达式或单位转换请求，你需要计算结果。
-请确保计算准确，并清晰地展示计算过程和最终结果。
-对于单位转换，请说明转换关系。
-如果是复杂的实时数据计算（如货币汇率转换），请建议用户先使用"/g 查询汇率"获取最新汇率，然后再进行计算。"""
-            
-            user_prompt = f"计算: {expression}"
-            
-            logger.info(f"[CalculationAgent] 完整系统提示词: '{system_prompt}'")
-            
-            # 调用AI模型
-            headers = {
-                "Authorization": f"Bearer {self.config.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": self.config.model_name,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.3
-            }
-            
-            response = requests.post(self.config.get_full_api_url(), json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            # 解析响应
-            calculation_result = response.json()["choices"][0]["message"]["content"]
+            # 调用AI模型，计算结果不随时间变化，缓存1小时
+            calculation_result = chat_completion(self.config, self._build_messages(expression), 0.3, cache_ttl=3600)
             return f"计算结果：\n{calculation_result}"
             
         except Exception as e:
             logger.error(f"使用LLM执行计算时出错: {str(e)}")
-            return f"计算失败: {str(e)}" 
\ No newline at end of file
+            return f"计算失败: {str(e)}"
+    
+    def calculate_with_llm_stream(self, expression):
+        """
+        流式执行计算，边生成边产出结果片段
+        
+        Args:
+            expression: 计算表达式
+            
+        Yields:
+            计算结果片段
+        """
+        try:
+            yield "计算结果：\n"
+            yield from iter_chat_completion(self.config, self._build_messages(expression), 0.3)
+            
+        except Exception as e:
+            logger.error(f"使用LLM流式执行计算时出错: {str(e)}")
+            yield f"计算失败: {str(e)}"
@@ -0,0 +1,178 @@
+"""
+HTTP客户端模块，为各代理提供共享的连接池会话
+"""
+
+import hashlib
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import TTLCache
+
+try:
+    # orjson为C扩展，解析速度明显快于标准库json
+    import orjson
+    loads = orjson.loads
+
+    def dumps(obj):
+        """序列化为JSON字符串"""
+        return orjson.dumps(obj).decode()
+except ImportError:
+    orjson = None
+    loads = json.loads
+
+    def dumps(obj):
+        """序列化为JSON字符串"""
+        return json.dumps(obj, ensure_ascii=False)
+
+# 请求超时（连接超时, 读取超时）
+TIMEOUT = (3, 30)
+# 流式请求的超时，读取超时为两个数据块之间的最大间隔
+STREAM_TIMEOUT = (3, 60)
+
+# 共享会话，复用与LLM接口之间的keep-alive连接，避免每次请求重新握手
+SESSION = requests.Session()
+# 连接失败、超时以及限流/服务端错误由urllib3按指数退避重试；聊天补全请求没有副作用，POST同样允许重试
+_ADAPTER = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        # 重试用尽后返回最后一次的响应，由调用方的raise_for_status处理
+        raise_on_status=False
+    )
+)
+# 自建或本地部署的接口可能使用http，同样走连接池
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
+
+# LLM响应缓存，按请求内容精确匹配
+_RESPONSE_CACHE = TTLCache(maxsize=512)
+
+def _build_headers(config, stream=False):
+    """构建请求头"""
+    headers = {
+        "Authorization": f"Bearer {config.api_key}",
+        "Content-Type": "application/json"
+    }
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    return headers
+
+def _cache_key(url, payload):
+    """根据请求地址和内容生成缓存键"""
+    return hashlib.sha256(
+        json.dumps([url, payload], ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+def chat_completion(config, messages, temperature, cache_ttl=0):
+    """
+    调用聊天补全接口并返回回复内容
+
+    Args:
+        config: 配置对象，包含API密钥等信息
+        messages: 消息列表
+        temperature: 采样温度
+        cache_ttl: 缓存有效期（秒），为0时不使用缓存
+
+    Returns:
+        回复内容
+    """
+    url = config.get_full_api_url()
+    payload = {
+        "model": config.model_name,
+        "messages": messages,
+        "temperature": temperature
+    }
+
+    if cache_ttl:
+        cache_key = _cache_key(url, payload)
+        content = _RESPONSE_CACHE.get(cache_key)
+        if content is not None:
+            return content
+
+    response = SESSION.post(url, json=payload, headers=_build_headers(config), timeout=TIMEOUT)
+    response.raise_for_status()
+
+    content = loads(response.content)["choices"][0]["message"]["content"]
+    if cache_ttl:
+        _RESPONSE_CACHE.set(cache_key, content, cache_ttl)
+    return content
+
+def iter_chat_completion(config, messages, temperature):
+    """
+    以流式方式调用聊天补全接口，逐段产出回复内容
+
+    Args:
+        config: 配置对象，包含API密钥等信息
+        messages: 消息列表
+        temperature: 采样温度
+
+    Yields:
+        回复内容片段
+    """
+    payload = {
+        "model": config.model_name,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True
+    }
+
+    with SESSION.post(config.get_full_api_url(), json=payload, headers=_build_headers(config, stream=True),
+                      stream=True, timeout=STREAM_TIMEOUT) as response:
+        response.raise_for_status()
+
+        # 按字节处理SSE行，避免服务端未声明charset时按ISO-8859-1解码中文
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+
+            choices = loads(data).get("choices")
+            if not choices:
+                continue
+
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
+
+def stream_chat_completion(config, messages, temperature, on_delta=None, cache_ttl=0):
+    """
+    以流式方式调用聊天补全接口，每收到一段内容即回调，结束后返回完整回复
+
+    Args:
+        config: 配置对象，包含API密钥等信息
+        messages: 消息列表
+        temperature: 采样温度
+        on_delta: 收到内容片段时的回调函数，接收片段字符串作为参数
+        cache_ttl: 缓存有效期（秒），为0时不使用缓存；与chat_completion共用同一缓存
+
+    Returns:
+        完整的回复内容
+    """
+    if cache_ttl:
+        cache_key = _cache_key(config.get_full_api_url(), {
+            "model": config.model_name,
+            "messages": messages,
+            "temperature": temperature
+        })
+        content = _RESPONSE_CACHE.get(cache_key)
+        if content is not None:
+            return content
+
+    parts = []
+    for delta in iter_chat_completion(config, messages, temperature):
+        parts.append(delta)
+        if on_delta is not None:
+            on_delta(delta)
+
+    content = "".join(parts)
+    if cache_ttl:
+        _RESPONSE_CACHE.set(cache_key, content, cache_ttl)
+    return content
@@ -3,12 +3,52 @@
 """
 
 import logging
-import requests
+import re
+import time
 from datetime import datetime
+from .http_client import chat_completion, iter_chat_completion
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 实时性查询关键词，合并为一个正则，一次扫描完成匹配
+_REALTIME_KEYWORDS_RE = re.compile('|'.join(map(re.escape, [
+    "天气", "股价", "汇率", "新闻", "疫情", "比赛", "比特币", "航班", "火车", "最新", "实时", "现在"
+])))
+
+# 当前时间字符串缓存（分钟序号, 格式化结果）
+_now_cache = (None, "")
+
+def _now_str():
+    """返回精确到分钟的当前时间字符串，同一分钟内只格式化一次"""
+    global _now_cache
+    minute = int(time.time() // 60)
+    cached_minute, text = _now_cache
+    if minute != cached_minute:
+        text = datetime.fromtimestamp(minute * 60).strftime("%Y年%m月%d日 %H:%M")
+        _now_cache = (minute, text)
+    return text
+
+# 搜索指令（静态部分），动态的当前时间放在用户消息中，保持系统提示词前缀稳定以命中服务端提示缓存
+_SEARCH_REALTIME_PROMPT = """你是一个强大的搜索助手，具有网络搜索能力。
+用户正在请求实时信息，你需要模拟网络搜索并提供最新、最相关的信息。
+用户消息中会给出当前时间，请确保提供的信息与当前时间相关。
+
+请按照以下格式提供回答：
+1. 简短总结搜索结果的核心信息（1-2句话）
+2. 提供3-5条最相关的详细信息点
+3. 如果是天气查询，提供当前温度、天气状况、未来预报等
+4. 如果是新闻查询，提供最新的相关新闻标题和简短摘要
+5. 如果是股票/汇率查询，提供最新价格、涨跌幅等关键数据
+
+请确保回答简洁、信息丰富，并以权威的口吻呈现，就像你真的进行了网络搜索一样。
+不要提及你没有真正的网络搜索能力，而是直接提供有用的信息。
+对于时间敏感的查询（如天气、新闻、股价等），请明确表示这些信息是基于用户消息中给出的当前时间的。"""
+
+_SEARCH_GENERAL_PROMPT = """你是一个搜索助手。用户会提供一个搜索查询，你需要提供相关的信息。
+请提供简洁、准确的回答，格式清晰易读。
+在回答中，如果涉及可能已过时的信息，请明确指出这一点。"""
+
 class SearchAgent:
     """搜索代理，处理各种搜索请求"""
     
@@ -48,8 +88,7 @@ class SearchAgent:
             return self.execute_search_with_llm(search_content)
         
         # 检查是否是实时性查询，如果是，自动转为网络搜索
-        realtime_keywords = ["天气", "股价", "汇率", "新闻", "疫情", "比赛", "比特币", "航班", "火车", "最新", "实时", "现在"]
-        is_realtime_query = any(keyword in query for keyword in realtime_keywords)
+        is_realtime_query = _REALTIME_KEYWORDS_RE.search(query) is not None
         
         if is_realtime_query:
             logger.info(f"[SearchAgent] 检测到实时性查询关键词，自动转为网络搜索: '{query}'")
@@ -60,6 +99,41 @@ class SearchAgent:
         logger.info(f"[SearchAgent] 执行普通搜索: '{query}'")
         return self.execute_search_with_llm(query, is_realtime=False)
     
+    def _build_messages(self, query, is_realtime):
+        """
+        构建搜索请求的消息列表
+        
+        Args:
+            query: 搜索查询
+            is_realtime: 是否是实时性查询
+            
+        Returns:
+            消息列表
+        """
+        # 获取当前时间
+        current_time_str = _now_str()
+        
+        # 使用配置中的系统提示词作为基础，并添加搜索特定的指令
+        base_system_prompt = self.config.system_prompt
+        logger.info(f"[SearchAgent] 使用基础系统提示词: '{base_system_prompt}'")
+        
+        if is_realtime:
+            # 构建系统提示，指示大模型执行网络搜索，但保留原始系统提示词的限制
+            system_prompt = f"{base_system_prompt}\n\n{_SEARCH_REALTIME_PROMPT}"
+            user_prompt = f"请搜索并提供关于以下内容的最新信息(当前时间: {current_time_str}): {query}"
+        else:
+            # 使用大模型进行普通搜索，同样保留原始系统提示词的限制
+            system_prompt = f"{base_system_prompt}\n\n{_SEARCH_GENERAL_PROMPT}"
+            user_prompt = f"搜索查询: {query}"
+        
+        logger.info(f"[SearchAgent] 准备调用API，模型: {self.config.model_name}")
+        logger.info(f"[SearchAgent] 完整系统提示词: '{system_prompt}'")
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
     def execute_search_with_llm(self, query, is_realtime=True):
         """
         使用大模型执行搜索功能，自动处理网络搜索请求
@@ -73,69 +147,12 @@ class SearchAgent:
         """
         try:
             logger.info(f"[SearchAgent] 开始执行LLM搜索，查询: '{query}'，实时: {is_realtime}")
+            messages = self._build_messages(query, is_realtime)
             
-            # 获取当前时间
-            now = datetime.now()
-            current_time_str = now.strftime("%Y年%m月%d日 %H:%M")
-            
-            # 使用配置中的系统提示词作为基础，并添加搜索特定的指令
-            base_system_prompt = self.config.system_prompt
-            logger.info(f"[SearchAgent] 使用基础系统提示词: '{base_system_prompt}'")
-            
-            if is_realtime:
-                # 构建系统提示，指示大模型执行网络搜索，但保留原始系统提示词的限制
-                system_prompt = f"""{base_system_prompt}
-
-你是一个强大的搜索助手，具有网络搜索能力。
-用户正在请求实时信息，你需要模拟网络搜索并提供最新、最相关的信息。
-当前时间是: {current_time_str}，请确保提供的信息与当前时间相关。
-
-请按照以下格式提供回答：
-1. 简短总结搜索结果的核心信息（1-2句话）
-2. 提供3-5条最相关的详细信息点
-3. 如果是天气查询，提供当前温度、天气状况、未来预报等
-4. 如果是新闻查询，提供最新的相关新闻标题和简短摘要
-5. 如果是股票/汇率查询，提供最新价格、涨跌幅等关键数据
-
-请确保回答简洁、信息丰富，并以权威的口吻呈现，就像你真的进行了网络搜索一样。
-不要提及你没有真正的网络搜索能力，而是直接提供有用的信息。
-对于时间敏感的查询（如天气、新闻、股价等），请明确表示这些信息是基于当前时间({current_time_str})的。"""
-                
-                user_prompt = f"请搜索并提供关于以下内容的最新信息(当前时间: {current_time_str}): {query}"
-            else:
-                # 使用大模型进行普通搜索，同样保留原始系统提示词的限制
-                system_prompt = f"""{base_system_prompt}
-
-你是一个搜索助手。用户会提供一个搜索查询，你需要提供相关的信息。
-请提供简洁、准确的回答，格式清晰易读。
-在回答中，如果涉及可能已过时的信息，请明确指出这一点。"""
-                
-                user_prompt = f"搜索查询: {query}"
-            
-            logger.info(f"[SearchAgent] 准备调用API，模型: {self.config.model_name}")
-            logger.info(f"[SearchAgent] 完整系统提示词: '{system_prompt}'")
-            
-            # 调用AI模型
-            headers = {
-                "Authorization": f"Bearer {self.config.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": self.config.model_name,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.5 if is_realtime else 0.7
-            }
-            
+            # 调用AI模型，实时信息只缓存1分钟，一般知识缓存1小时
             logger.info(f"[SearchAgent] 发送API请求到: {self.config.get_full_api_url()}")
-            response = requests.post(self.config.get_full_api_url(), json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            # 解析响应
-            search_result = response.json()["choices"][0]["message"]["content"]
+            search_result = chat_completion(self.config, messages, 0.5 if is_realtime else 0.7,
+                                            cache_ttl=60 if is_realtime else 3600)
             logger.info(f"[SearchAgent] 成功获取搜索结果，长度: {len(search_result)}")
             
             if not is_realtime:
@@ -144,4 +161,27 @@ class SearchAgent:
             
         except Exception as e:
             logger.error(f"[SearchAgent] 执行搜索时出错: {str(e)}")
-            return f"搜索失败: {str(e)}" 
\ No newline at end of file
+            return f"搜索失败: {str(e)}"
+    
+    def execute_search_with_llm_stream(self, query, is_realtime=True):
+        """
+        流式执行搜索，边生成边产出结果片段，适合需要尽快转发首段内容的调用方
+        
+        Args:
+            query: 搜索查询
+            is_realtime: 是否是实时性查询
+            
+        Yields:
+            搜索结果片段
+        """
+        try:
+            logger.info(f"[SearchAgent] 开始执行流式LLM搜索，查询: '{query}'，实时: {is_realtime}")
+            messages = self._build_messages(query, is_realtime)
+            
+            if not is_realtime:
+                yield "搜索结果：\n"
+            yield from iter_chat_completion(self.config, messages, 0.5 if is_realtime else 0.7)
+            
+        except Exception as e:
+            logger.error(f"[SearchAgent] 执行流式搜索时出错: {str(e)}")
+            yield f"搜索失败: {str(e)}"
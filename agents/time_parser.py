@@ -5,13 +5,78 @@
 import re
 import json
 import logging
+import functools
 from datetime import datetime, timedelta
-import requests
-from dateutil import parser
+from .http_client import SESSION, TIMEOUT, loads
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 常用时间间隔
+_TD_1D = timedelta(days=1)
+_TD_2D = timedelta(days=2)
+
+def _hm(name):
+    """时[点:：]分 片段，分组名以规则名为前缀"""
+    return rf'(?P<{name}_h>\d{{1,2}})[点:：](?P<{name}_m>\d{{1,2}})?'
+
+def _clock(days=0, pm=False):
+    """生成"某天某时某分"的处理函数，days为相对今天的天数（0-2）"""
+    def build(m, ctx):
+        name = m.lastgroup
+        hour = int(m[f'{name}_h'])
+        if pm and hour < 12:
+            hour += 12
+        return ctx[days].replace(hour=hour, minute=int(m[f'{name}_m'] or 0), second=0, microsecond=0)
+    return build
+
+def _later(unit):
+    """生成"N分钟/小时/天后"的处理函数"""
+    return lambda m, ctx: ctx[0] + timedelta(**{unit: int(m[f'{m.lastgroup}_n'])})
+
+# 常见时间表达式规则（名称, 模式, 处理函数），按列表顺序优先匹配，处理函数接收匹配对象和(今天, 明天, 后天)时间快照
+_TIME_RULES = (
+    # 今天/明天/后天 + 时间
+    ('today', rf'今天\s*{_hm("today")}', _clock(0)),
+    ('tomorrow', rf'明天\s*{_hm("tomorrow")}', _clock(1)),
+    ('day_after', rf'后天\s*{_hm("day_after")}', _clock(2)),
+    
+    # X分钟/小时/天后
+    ('minutes_later', r'(?P<minutes_later_n>\d+)\s*分钟后', _later('minutes')),
+    ('hours_later', r'(?P<hours_later_n>\d+)\s*小时后', _later('hours')),
+    ('days_later', r'(?P<days_later_n>\d+)\s*天后', _later('days')),
+    
+    # 下午/晚上 + 时间
+    ('today_pm', rf'今天\s*下午\s*{_hm("today_pm")}', _clock(0, pm=True)),
+    ('tomorrow_pm', rf'明天\s*下午\s*{_hm("tomorrow_pm")}', _clock(1, pm=True)),
+    
+    # 日期格式，需排在简单时间格式之前，否则"2027-03-01 10:00"中的"10:"会先被当作今天的时间
+    ('date', rf'(?P<date_y>\d{{4}})[-/年](?P<date_mo>\d{{1,2}})[-/月](?P<date_d>\d{{1,2}})[日号]?\s*{_hm("date")}',
+     lambda m, ctx: datetime(int(m['date_y']), int(m['date_mo']), int(m['date_d']), int(m['date_h']), int(m['date_m'] or 0))),
+    
+    # 下午/晚上 + 时间，需排在简单时间格式之前，否则"下午3点"会被当作3点
+    ('pm', rf'下午\s*{_hm("pm")}', _clock(0, pm=True)),
+    ('evening', rf'晚上\s*{_hm("evening")}', _clock(0, pm=True)),
+    
+    # 简单时间格式
+    ('clock', _hm("clock"), _clock(0))
+)
+
+# 每条规则预编译为以规则名为外层分组的正则，处理函数通过lastgroup取得规则名
+_TIME_PATTERNS = tuple((re.compile(f'(?P<{name}>{pattern})'), handler) for name, pattern, handler in _TIME_RULES)
+
+# 中文数字相对时间模式（如"一分钟后"、"两个小时之后"等）
+_CHINESE_NUM_MAP = {'一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+_CHINESE_RELATIVE_RE = re.compile(r'([一二两三四五六七八九十])\s*个?\s*(分钟|小时|天)(?:[以之]?后|.*?(?:以后|之后|过后))')
+_CHINESE_UNIT_MAP = {'分钟': 'minutes', '小时': 'hours', '天': 'days'}
+
+# ISO或斜杠分隔的日期（如2027-03-01、2027/3/1、3/1），只有这类字符串才交给dateutil解析
+_NUMERIC_DATE_RE = re.compile(r'\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}/\d{1,2}')
+_CHINESE_NUM_CHARS = frozenset(_CHINESE_NUM_MAP)
+
+# LLM响应中的ISO格式时间，JSON解析失败时兜底提取
+_ISO_DT_RE = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
+
 def parse_time_from_message(time_str):
     """
     从消息中解析时间表达式
@@ -22,132 +87,67 @@ def parse_time_from_message(time_str):
     Returns:
         datetime对象或None（如果无法解析）
     """
-    try:
-        # 当前时间
-        now = datetime.now()
+    # 当前时间
+    now = datetime.now()
+    
+    # 既没有数字也没有中文数字时，下面的模式都不可能匹配
+    has_digit = any(c.isdigit() for c in time_str)
+    if not has_digit and _CHINESE_NUM_CHARS.isdisjoint(time_str):
+        return None
+    
+    # 按规则顺序尝试匹配，第一条匹配的规则生效
+    for regex, handler in _TIME_PATTERNS:
+        match = regex.search(time_str)
+        if not match:
+            continue
+        ctx = (now, now + _TD_1D, now + _TD_2D)
+        try:
+            parsed_time = handler(match, ctx)
+        except (ValueError, OverflowError) as e:
+            # 如"25点"、"2月30日"等超出范围的时间
+            logger.warning(f"时间表达式超出有效范围: {match.group(0)}, {str(e)}")
+            return None
         
-        # 尝试直接解析
+        # 如果解析出的时间已经过去，且是今天的时间，则可能是指明天
+        if parsed_time < now and "今天" not in time_str and "明天" not in time_str and "后天" not in time_str and (now - parsed_time).days < 1:
+            parsed_time += _TD_1D
+        
+        return parsed_time
+    
+    # 规则未匹配时，ISO或斜杠分隔的日期交给dateutil解析；中文时间表达式不走dateutil，避免被误解析
+    if has_digit and _NUMERIC_DATE_RE.search(time_str):
+        # dateutil导入较重，只在需要模糊解析时才加载
+        from dateutil import parser
         try:
             return parser.parse(time_str, fuzzy=True)
-        except:
+        except (ValueError, OverflowError):
             pass
-        
-        # 常见时间表达式模式
-        patterns = [
-            # 今天/明天/后天 + 时间
-            (r'今天\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: now.replace(hour=int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            (r'明天\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: (now + timedelta(days=1)).replace(hour=int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            (r'后天\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: (now + timedelta(days=2)).replace(hour=int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            
-            # X分钟/小时/天后
-            (r'(\d+)\s*分钟后', lambda m: now + timedelta(minutes=int(m.group(1)))),
-            (r'(\d+)\s*小时后', lambda m: now + timedelta(hours=int(m.group(1)))),
-            (r'(\d+)\s*天后', lambda m: now + timedelta(days=int(m.group(1)))),
-            
-            # 下午/晚上 + 时间
-            (r'今天\s*下午\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: now.replace(hour=int(m.group(1)) + 12 if int(m.group(1)) < 12 else int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            (r'明天\s*下午\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: (now + timedelta(days=1)).replace(hour=int(m.group(1)) + 12 if int(m.group(1)) < 12 else int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            
-            # 简单时间格式
-            (r'(\d{1,2})[点:：](\d{1,2})?', lambda m: now.replace(hour=int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            (r'下午\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: now.replace(hour=int(m.group(1)) + 12 if int(m.group(1)) < 12 else int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            (r'晚上\s*(\d{1,2})[点:：](\d{1,2})?', lambda m: now.replace(hour=int(m.group(1)) + 12 if int(m.group(1)) < 12 else int(m.group(1)), minute=int(m.group(2) or 0), second=0, microsecond=0)),
-            
-            # 日期格式
-            (r'(\d{4})[-/年](\d{1,2})[-/月](\d{1,2})[日号]?\s*(\d{1,2})[点:：](\d{1,2})?', 
-             lambda m: datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)), int(m.group(4)), int(m.group(5) or 0)))
-        ]
-        
-        # 尝试匹配模式
-        for pattern, time_func in patterns:
-            match = re.search(pattern, time_str)
-            if match:
-                parsed_time = time_func(match)
-                
-                # 如果解析出的时间已经过去，且是今天的时间，则可能是指明天
-                if parsed_time < now and "今天" not in time_str and "明天" not in time_str and "后天" not in time_str and (now - parsed_time).days < 1:
-                    parsed_time += timedelta(days=1)
-                
-                return parsed_time
-        
-        # 相对时间模式
-        relative_pattern = r'(\d+)\s*(分钟|小时|天)后'
-        relative_match = re.search(relative_pattern, time_str)
-        if relative_match:
-            amount = int(relative_match.group(1))
-            unit = relative_match.group(2)
-            if unit == '分钟':
-                return now + timedelta(minutes=amount)
-            elif unit == '小时':
-                return now + timedelta(hours=amount)
-            elif unit == '天':
-                return now + timedelta(days=amount)
-        
-        # 更宽松的相对时间模式（如"一分钟后"、"两小时后"等）
-        chinese_num_map = {'一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
-        chinese_relative_pattern = r'([一二两三四五六七八九十])\s*(分钟|小时|天)后'
-        chinese_relative_match = re.search(chinese_relative_pattern, time_str)
-        if chinese_relative_match:
-            amount = chinese_num_map.get(chinese_relative_match.group(1), 1)
-            unit = chinese_relative_match.group(2)
-            if unit == '分钟':
-                return now + timedelta(minutes=amount)
-            elif unit == '小时':
-                return now + timedelta(hours=amount)
-            elif unit == '天':
-                return now + timedelta(days=amount)
-        
-        # 更宽松的相对时间模式（如"一个小时以后"、"两个小时之后"等）
-        chinese_relative_pattern2 = r'([一二两三四五六七八九十])\s*个?\s*(分钟|小时|天)[以之]?后'
-        chinese_relative_match2 = re.search(chinese_relative_pattern2, time_str)
-        if chinese_relative_match2:
-            amount = chinese_num_map.get(chinese_relative_match2.group(1), 1)
-            unit = chinese_relative_match2.group(2)
-            if unit == '分钟':
-                return now + timedelta(minutes=amount)
-            elif unit == '小时':
-                return now + timedelta(hours=amount)
-            elif unit == '天':
-                return now + timedelta(days=amount)
-        
-        # 更宽松的相对时间模式（如"一个小时以后"、"两个小时之后"等）- 更广泛的匹配
-        chinese_relative_pattern3 = r'([一二两三四五六七八九十])\s*个?\s*(分钟|小时|天).*?(以后|之后|过后)'
-        chinese_relative_match3 = re.search(chinese_relative_pattern3, time_str)
-        if chinese_relative_match3:
-            amount = chinese_num_map.get(chinese_relative_match3.group(1), 1)
-            unit = chinese_relative_match3.group(2)
-            if unit == '分钟':
-                return now + timedelta(minutes=amount)
-            elif unit == '小时':
-                return now + timedelta(hours=amount)
-            elif unit == '天':
-                return now + timedelta(days=amount)
-        
-        return None
-        
-    except Exception as e:
-        logger.error(f"解析时间表达式时出错: {str(e)}")
-        return None
+    
+    # 中文数字相对时间模式（如"一分钟后"、"一个小时以后"、"两个小时之后"等）
+    chinese_relative_match = _CHINESE_RELATIVE_RE.search(time_str)
+    if chinese_relative_match:
+        amount = _CHINESE_NUM_MAP.get(chinese_relative_match.group(1), 1)
+        unit = _CHINESE_UNIT_MAP[chinese_relative_match.group(2)]
+        return now + timedelta(**{unit: amount})
+    
+    return None
 
-def parse_time_with_llm(time_expression, context=None, config=None):
+@functools.lru_cache(maxsize=1024)
+def _llm_parse(time_expression, context, current_time_str, config):
     """
-    使用大模型解析时间表达式
+    调用大模型解析时间表达式，结果按(表达式, 上下文, 当前分钟)缓存
     
     Args:
         time_expression: 用户输入的时间表达式
-        context: 可选的上下文信息，如对话历史
+        context: 可选的上下文信息
+        current_time_str: 精确到分钟的当前时间，作为解析参考并参与缓存键
         config: 配置信息
         
     Returns:
-        datetime对象或None（如果无法解析）
+        ISO格式的时间字符串或None（如果无法解析）
     """
-    try:
-        # 当前时间作为参考
-        now = datetime.now()
-        current_time_str = now.strftime("%Y-%m-%d %H:%M:%S")
-        
-        # 构建提示
-        system_prompt = """你是一个专门解析时间表达式的AI助手。
+    # 构建提示
+    system_prompt = """你是一个专门解析时间表达式的AI助手。
 你的任务是将用户输入的自然语言时间表达式转换为标准的时间格式。
 请分析输入的时间表达式，并返回一个JSON格式的响应，包含以下字段：
 1. parsed_time: ISO格式的时间字符串（YYYY-MM-DDTHH:MM:SS）
@@ -156,77 +156,99 @@ def parse_time_with_llm(time_expression, context=None, config=None):
 
 如果无法解析，请将parsed_time设为null，并在reasoning中解释原因。
 当前时间是: {current_time}"""
+    
+    user_prompt = f"请解析以下时间表达式：{time_expression}"
+    
+    # 添加上下文（如果有）
+    if context:
+        user_prompt += f"\n上下文信息：{context}"
+    
+    # 调用AI模型
+    headers = {
+        "Authorization": f"Bearer {config.api_key}",
+        "Content-Type": "application/json"
+    }
+    
+    payload = {
+        "model": config.model_name,
+        "messages": [
+            {"role": "system", "content": system_prompt.format(current_time=current_time_str)},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": 0.2,  # 使用较低的温度以获得更确定的回答
+        "response_format": {"type": "json_object"}  # JSON模式，响应体可直接解析
+    }
+    
+    response = SESSION.post(config.get_full_api_url(), json=payload, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 400:
+        # 部分兼容接口不支持response_format，去掉后重试
+        logger.warning("接口不支持JSON模式，使用普通模式重试")
+        del payload["response_format"]
+        response = SESSION.post(config.get_full_api_url(), json=payload, headers=headers, timeout=TIMEOUT)
+    response.raise_for_status()
+    
+    # 解析响应
+    ai_response = loads(response.content)["choices"][0]["message"]["content"]
+    logger.info(f"LLM时间解析响应: {ai_response}")
+    
+    # JSON模式下响应本身即为JSON
+    try:
+        result = loads(ai_response)
         
-        user_prompt = f"请解析以下时间表达式：{time_expression}"
-        
-        # 添加上下文（如果有）
-        if context:
-            user_prompt += f"\n上下文信息：{context}"
-        
-        # 调用AI模型
-        headers = {
-            "Authorization": f"Bearer {config.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": config.model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt.format(current_time=current_time_str)},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.2  # 使用较低的温度以获得更确定的回答
-        }
-        
-        response = requests.post(config.get_full_api_url(), json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        # 解析响应
-        ai_response = response.json()["choices"][0]["message"]["content"]
-        logger.info(f"LLM时间解析响应: {ai_response}")
-        
-        # 尝试从响应中提取JSON
-        try:
-            # 查找JSON部分
-            json_match = re.search(r'```json\s*(.*?)\s*```', ai_response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # 尝试直接解析整个响应
-                json_str = ai_response
-                
-            result = json.loads(json_str)
-            
-            # 检查置信度
-            if result.get("confidence", 0) < 0.5:
-                logger.warning(f"时间解析置信度低: {result.get('confidence')}, 原因: {result.get('reasoning')}")
-                return None
-                
-            # 解析ISO格式时间
-            if result.get("parsed_time"):
-                parsed_time = parser.parse(result["parsed_time"])
-                logger.info(f"成功解析时间表达式: {time_expression} -> {parsed_time}, 置信度: {result.get('confidence')}")
-                return parsed_time
-            else:
-                logger.warning(f"无法解析时间表达式: {time_expression}, 原因: {result.get('reasoning')}")
-                return None
-                
-        except json.JSONDecodeError:
-            logger.error(f"无法从AI响应中解析JSON: {ai_response}")
+        # 检查置信度
+        if result.get("confidence", 0) < 0.5:
+            logger.warning(f"时间解析置信度低: {result.get('confidence')}, 原因: {result.get('reasoning')}")
+            return None
             
-            # 尝试直接从文本中提取时间
+        # 解析ISO格式时间
+        if result.get("parsed_time"):
             try:
-                # 查找可能的日期时间格式
-                dt_match = re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', ai_response)
-                if dt_match:
-                    parsed_time = parser.parse(dt_match.group(0))
-                    logger.info(f"从文本中提取到时间: {parsed_time}")
-                    return parsed_time
-            except:
-                pass
-                
+                parsed_time = datetime.fromisoformat(result["parsed_time"])
+            except ValueError:
+                # 非标准ISO格式时退回dateutil
+                from dateutil import parser
+                parsed_time = parser.parse(result["parsed_time"])
+            logger.info(f"成功解析时间表达式: {time_expression} -> {parsed_time}, 置信度: {result.get('confidence')}")
+            return parsed_time.isoformat()
+        else:
+            logger.warning(f"无法解析时间表达式: {time_expression}, 原因: {result.get('reasoning')}")
             return None
             
+    except json.JSONDecodeError:
+        logger.error(f"无法从AI响应中解析JSON: {ai_response}")
+        
+        # 尝试直接从文本中提取时间
+        try:
+            # 查找可能的日期时间格式
+            dt_match = _ISO_DT_RE.search(ai_response)
+            if dt_match:
+                parsed_time = datetime.fromisoformat(dt_match.group(0))
+                logger.info(f"从文本中提取到时间: {parsed_time}")
+                return parsed_time.isoformat()
+        except ValueError as e:
+            logger.warning(f"从文本中提取时间失败: {str(e)}")
+            
+        return None
+
+def parse_time_with_llm(time_expression, context=None, config=None):
+    """
+    使用大模型解析时间表达式
+    
+    Args:
+        time_expression: 用户输入的时间表达式
+        context: 可选的上下文信息，如对话历史
+        config: 配置信息
+        
+    Returns:
+        datetime对象或None（如果无法解析）
+    """
+    try:
+        # 当前时间作为参考，精确到分钟，同一分钟内相同的表达式直接复用解析结果
+        current_time_str = datetime.now().strftime("%Y-%m-%d %H:%M")
+        
+        parsed_time = _llm_parse(time_expression, context, current_time_str, config)
+        return datetime.fromisoformat(parsed_time) if parsed_time else None
+            
     except Exception as e:
         logger.error(f"使用LLM解析时间时出错: {str(e)}")
-        return None 
\ No newline at end of file
+        return None
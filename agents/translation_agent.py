@@ -3,7 +3,7 @@
 """
 
 import logging
-import requests
+from .http_client import SESSION, TIMEOUT, loads
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -19,6 +19,17 @@ class TranslationAgent:
             config: 配置对象，包含API密钥等信息
         """
         self.config = config
+        
+        # 请求地址、请求头和基础参数在实例内复用
+        self._url = config.get_full_api_url()
+        self._headers = {
+            "Authorization": f"Bearer {config.api_key}",
+            "Content-Type": "application/json"
+        }
+        self._base_payload = {
+            "model": config.model_name,
+            "temperature": 0.3
+        }
     
     def translate(self, text, target_language="英语"):
         """
@@ -48,25 +59,19 @@ class TranslationAgent:
             logger.info(f"[TranslationAgent] 完整系统提示词: '{system_prompt}'")
             
             # 调用AI模型
-            headers = {
-                "Authorization": f"Bearer {self.config.api_key}",
-                "Content-Type": "application/json"
-            }
-            
             payload = {
-                "model": self.config.model_name,
+                **self._base_payload,
                 "messages": [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.3
+                ]
             }
             
-            response = requests.post(self.config.get_full_api_url(), json=payload, headers=headers, timeout=30)
+            response = SESSION.post(self._url, json=payload, headers=self._headers, timeout=TIMEOUT)
             response.raise_for_status()
             
             # 解析响应
-            translation_result = response.json()["choices"][0]["message"]["content"]
+            translation_result = loads(response.content)["choices"][0]["message"]["content"]
             return f"翻译结果：\n{translation_result}"
             
         except Exception as e:
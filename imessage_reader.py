@@ -1,13 +1,38 @@
 #!/usr/bin/env python3
 import sqlite3
 import os
+import logging
 from datetime import datetime
-import pandas as pd
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import threading
 import queue
+from urllib.parse import quote
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每次轮询最多读取的消息数，积压较多时分批处理
+MESSAGE_BATCH_SIZE = 500
+
+# 查询新消息，SQL文本固定以便复用已编译的语句；列别名与消息字段名一致，sqlite3.Row可直接按字段名访问
+# message.date为自2001-01-01起的纳秒数，978307200即strftime('%s', '2001-01-01')，直接写成常量避免逐行计算
+NEW_MESSAGES_QUERY = """
+SELECT 
+    datetime(message.date/1000000000 + 978307200, 'unixepoch', 'localtime') AS date,
+    message.text AS text,
+    handle.id AS contact,
+    message.is_from_me AS is_from_me,
+    message.cache_roomnames AS group_chat,
+    message.date AS original_date
+FROM message 
+LEFT JOIN handle ON message.handle_id = handle.ROWID
+WHERE message.text IS NOT NULL
+AND message.date > ?
+ORDER BY message.date ASC
+LIMIT ?
+"""
 
 class iMessageDatabaseHandler(FileSystemEventHandler):
     def __init__(self, event_queue):
@@ -16,29 +41,40 @@ class iMessageDatabaseHandler(FileSystemEventHandler):
         self.cooldown = 0.5
 
     def on_modified(self, event):
-        if event.src_path.endswith('chat.db'):
-            current_time = time.time()
+        # Messages先写入WAL文件，chat.db本身往往要到checkpoint时才变化
+        if event.src_path.endswith(('chat.db', 'chat.db-wal')):
+            # 使用单调时钟，不受系统时间调整影响
+            current_time = time.monotonic()
             if current_time - self.last_event_time >= self.cooldown:
                 self.last_event_time = current_time
-                self.event_queue.put('database_changed')
+                # 队列中已有待处理事件时无需重复放入，一次查询即可读到所有新消息
+                if self.event_queue.empty():
+                    self.event_queue.put_nowait('database_changed')
 
 class DatabaseThread(threading.Thread):
-    def __init__(self, db_path, event_queue, callback=None):
+    def __init__(self, db_path, event_queue, callback=None, as_dict=True):
         super().__init__()
         self.db_path = db_path
         self.event_queue = event_queue
         self.callback = callback
+        # 为False时直接把sqlite3.Row传给回调，省去逐条构建字典
+        self.as_dict = as_dict
         self.connection = None
+        self._cursor = None
         self.last_message_date = None
         self.running = True
         
     def connect(self):
         """连接到数据库"""
         try:
-            self.connection = sqlite3.connect(self.db_path, timeout=5)
+            # 以只读方式打开，避免与Messages进程争用写锁
+            self.connection = sqlite3.connect(f"file:{quote(self.db_path)}?mode=ro", uri=True, timeout=5)
+            self.connection.execute("PRAGMA query_only=1")
+            self.connection.row_factory = sqlite3.Row
+            self._cursor = self.connection.cursor()
             return True
         except Exception as e:
-            print(f"连接数据库时出错: {str(e)}")
+            logger.error(f"连接数据库时出错: {str(e)}")
             return False
             
     def get_latest_message_date(self):
@@ -54,12 +90,11 @@ class DatabaseThread(threading.Thread):
         """
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query)
-            result = cursor.fetchone()
+            self._cursor.execute(query)
+            result = self._cursor.fetchone()
             return result[0] if result[0] else None
         except Exception as e:
-            print(f"获取最新消息时间时出错: {str(e)}")
+            logger.error(f"获取最新消息时间时出错: {str(e)}")
             return None
             
     def check_new_messages(self):
@@ -69,64 +104,53 @@ class DatabaseThread(threading.Thread):
                 if not self.connect():
                     return
 
-            current_latest_date = self.get_latest_message_date()
+            self._cursor.execute(NEW_MESSAGES_QUERY, (self.last_message_date if self.last_message_date else 0, MESSAGE_BATCH_SIZE))
             
-            if current_latest_date and (self.last_message_date is None or current_latest_date > self.last_message_date):
-                query = """
-                SELECT 
-                    datetime(message.date/1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') AS message_date,
-                    message.text,
-                    handle.id as contact,
-                    message.is_from_me,
-                    message.cache_roomnames,
-                    message.date AS original_date
-                FROM message 
-                LEFT JOIN handle ON message.handle_id = handle.ROWID
-                WHERE message.text IS NOT NULL
-                AND message.date > ?
-                ORDER BY message.date ASC
-                """
-                
-                df = pd.read_sql_query(query, self.connection, params=(self.last_message_date if self.last_message_date else 0,))
-                
-                new_messages = []
-                for _, row in df.iterrows():
-                    msg = {
-                        'date': row['message_date'],
-                        'contact': row['contact'],
-                        'text': row['text'],
-                        'is_from_me': bool(row['is_from_me']),
-                        'group_chat': row['cache_roomnames'],
-                        'original_date': row['original_date']
-                    }
-                    new_messages.append(msg)
-                    
-                    # 打印新消息
+            new_messages = self._cursor.fetchall()
+            if self.as_dict:
+                new_messages = [{
+                    'date': row['date'],
+                    'contact': row['contact'],
+                    'text': row['text'],
+                    'is_from_me': bool(row['is_from_me']),
+                    'group_chat': row['group_chat'],
+                    'original_date': row['original_date']
+                } for row in new_messages]
+            
+            # 记录新消息，日志级别未启用时跳过逐条格式化
+            if logger.isEnabledFor(logging.INFO):
+                for msg in new_messages:
                     sender = "我" if msg['is_from_me'] else msg['contact']
                     group_info = f" (群聊: {msg['group_chat']})" if msg['group_chat'] else ""
-                    print(f"[{msg['date']}] {sender}{group_info}: {msg['text']}")
-                
-                if self.callback and new_messages:
-                    self.callback(new_messages)
-                
-                self.last_message_date = current_latest_date
+                    logger.info("[%s] %s%s: %s", msg['date'], sender, group_info, msg['text'])
+            
+            if self.callback and new_messages:
+                self.callback(new_messages)
+            
+            # 直接从结果中取最新时间戳，无需再单独查询MAX(date)
+            if new_messages:
+                self.last_message_date = max(msg['original_date'] for msg in new_messages)
+            
+            # 本批已满说明还有未读消息，重新放入事件继续处理
+            if len(new_messages) == MESSAGE_BATCH_SIZE:
+                self.event_queue.put('database_changed')
                 
         except Exception as e:
-            print(f"检查新消息时出错: {str(e)}")
+            logger.error(f"检查新消息时出错: {str(e)}")
             # 如果发生错误，尝试重新连接
             self.connection = None
             
     def run(self):
         """运行数据库线程"""
-        print("数据库监控线程启动...")
+        logger.info("数据库监控线程启动...")
         
         # 初始连接
         if not self.connect():
-            print("无法连接到数据库，线程退出")
+            logger.error("无法连接到数据库，线程退出")
             return
             
         self.last_message_date = self.get_latest_message_date()
-        print(f"初始化完成，最后消息时间戳: {self.last_message_date}")
+        logger.info(f"初始化完成，最后消息时间戳: {self.last_message_date}")
         
         while self.running:
             try:
@@ -139,7 +163,7 @@ class DatabaseThread(threading.Thread):
                     # 即使没有事件，也定期检查一次
                     self.check_new_messages()
             except Exception as e:
-                print(f"处理事件时出错: {str(e)}")
+                logger.error(f"处理事件时出错: {str(e)}")
                 time.sleep(1)
                 
         # 关闭连接
@@ -153,69 +177,110 @@ class DatabaseThread(threading.Thread):
 class iMessageReader:
     def __init__(self):
         self.db_path = os.path.expanduser("~/Library/Messages/chat.db")
+        self._stop_event = threading.Event()
+        self._observer = None
+        self._db_thread = None
+        self._lock = threading.Lock()
         
     def check_db_access(self):
         """检查数据库文件是否存在且可访问"""
         if not os.path.exists(self.db_path):
-            print(f"错误: 找不到数据库文件 {self.db_path}")
-            print("请确保你使用的是 macOS 系统，并且有 iMessage 的聊天记录")
+            logger.error(f"错误: 找不到数据库文件 {self.db_path}")
+            logger.error("请确保你使用的是 macOS 系统，并且有 iMessage 的聊天记录")
             return False
             
         if not os.access(self.db_path, os.R_OK):
-            print(f"错误: 无法读取数据库文件 {self.db_path}")
-            print("请按照以下步骤授予权限：")
-            print("1. 打开'系统设置'")
-            print("2. 进入'隐私与安全性' -> '完全磁盘访问权限'")
-            print("3. 点击'+'号添加你的终端应用（Terminal.app 或 iTerm）")
-            print("4. 确保该应用的开关是打开的")
-            print("5. 重启终端应用")
+            logger.error(f"错误: 无法读取数据库文件 {self.db_path}")
+            logger.error("请按照以下步骤授予权限：")
+            logger.error("1. 打开'系统设置'")
+            logger.error("2. 进入'隐私与安全性' -> '完全磁盘访问权限'")
+            logger.error("3. 点击'+'号添加你的终端应用（Terminal.app 或 iTerm）")
+            logger.error("4. 确保该应用的开关是打开的")
+            logger.error("5. 重启终端应用")
             return False
         return True
 
-    def monitor_messages(self, callback=None):
+    def start(self, callback=None, as_dict=True):
         """
-        使用文件系统事件监控新消息
+        启动数据库线程和文件系统观察者后立即返回，不额外占用一个阻塞等待的线程
         
         Args:
             callback (callable): 收到新消息时的回调函数，接收消息列表作为参数
+            as_dict (bool): 是否把消息转换为字典，为False时传入可按字段名访问的sqlite3.Row
+            
+        Returns:
+            bool: 是否成功启动
         """
         if not self.check_db_access():
-            print("无法访问 iMessage 数据库，请确保已授予权限")
-            return
+            logger.error("无法访问 iMessage 数据库，请确保已授予权限")
+            return False
             
         # 创建事件队列
         event_queue = queue.Queue()
         
         # 创建并启动数据库线程
-        db_thread = DatabaseThread(self.db_path, event_queue, callback)
-        db_thread.start()
+        self._db_thread = DatabaseThread(self.db_path, event_queue, callback, as_dict)
+        self._db_thread.daemon = True
+        self._db_thread.start()
         
         # 创建文件系统观察者
-        observer = Observer()
+        self._observer = Observer()
         handler = iMessageDatabaseHandler(event_queue)
         
         # 获取数据库所在目录
         db_dir = os.path.dirname(self.db_path)
-        observer.schedule(handler, db_dir, recursive=False)
+        self._observer.schedule(handler, db_dir, recursive=False)
         
-        print("开始监控新消息...")
-        print(f"监控数据库文件: {self.db_path}")
+        logger.info("开始监控新消息...")
+        logger.info(f"监控数据库文件: {self.db_path}")
         
+        self._stop_event.clear()
+        self._observer.start()
+        return True
+
+    def monitor_messages(self, callback=None, as_dict=True):
+        """
+        使用文件系统事件监控新消息，阻塞直到调用stop
+        
+        Args:
+            callback (callable): 收到新消息时的回调函数，接收消息列表作为参数
+            as_dict (bool): 是否把消息转换为字典，为False时传入可按字段名访问的sqlite3.Row
+        """
+        if not self.start(callback, as_dict):
+            return
+            
         try:
-            observer.start()
-            while True:
-                time.sleep(0.1)
+            # 阻塞等待停止信号，空闲时不占用CPU
+            self._stop_event.wait()
         except KeyboardInterrupt:
-            print("\n停止监控消息")
-            observer.stop()
-            db_thread.stop()
-            observer.join()
-            db_thread.join()
+            pass
+        
+        self.stop()
+    
+    def stop(self):
+        """停止监控消息，可重复调用"""
+        self._stop_event.set()
+        with self._lock:
+            observer, db_thread = self._observer, self._db_thread
+            self._observer = self._db_thread = None
+        if observer is None:
+            return
+        
+        logger.info("停止监控消息")
+        observer.stop()
+        db_thread.stop()
+        observer.join()
+        db_thread.join()
 
 if __name__ == "__main__":
     # 使用示例
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    
     def on_new_message(messages):
-        print(f"收到 {len(messages)} 条新消息！")
+        logger.info(f"收到 {len(messages)} 条新消息！")
     
     reader = iMessageReader()
     reader.monitor_messages(callback=on_new_message) 
\ No newline at end of file
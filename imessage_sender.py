@@ -1,6 +1,47 @@
 #!/usr/bin/env python3
 import subprocess
 import os
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 当前脚本所在目录下的AppleScript源文件
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'send_message.applescript')
+
+# 预编译后的脚本路径，首次发送时生成
+_compiled_script = None
+_compile_lock = threading.Lock()
+
+# 批量发送线程池，osascript调用为I/O等待，可并行执行
+_send_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='imessage-send')
+
+def _get_script_path():
+    """
+    获取用于发送的脚本路径
+    
+    首次调用时用osacompile把AppleScript编译为.scpt，之后每次发送都直接执行编译结果，
+    省去osascript每次重新编译源码的开销；编译失败时退回源脚本。
+    编译结果放在本进程创建的私有临时目录中，每次启动都从源脚本重新编译，不复用其他进程或用户留下的文件
+    """
+    global _compiled_script
+    with _compile_lock:
+        if _compiled_script is None:
+            try:
+                compile_dir = tempfile.mkdtemp(prefix='imessage_llm_')
+                atexit.register(shutil.rmtree, compile_dir, ignore_errors=True)
+                compiled_path = os.path.join(compile_dir, 'send_message.scpt')
+                subprocess.run(['osacompile', '-o', compiled_path, SCRIPT_PATH], check=True, capture_output=True)
+                _compiled_script = compiled_path
+            except Exception as e:
+                logger.warning(f"预编译AppleScript失败，使用源脚本: {str(e)}")
+                _compiled_script = SCRIPT_PATH
+        return _compiled_script
 
 def send_imessage(contact, message):
     """
@@ -9,24 +50,37 @@ def send_imessage(contact, message):
     Args:
         contact (str): 联系人的电话号码或Apple ID
         message (str): 要发送的消息内容
-    """
-    # 获取当前脚本所在目录
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(current_dir, 'send_message.applescript')
     
+    Returns:
+        bool: 是否发送成功
+    """
     # 执行AppleScript
-    cmd = ['osascript', script_path, contact, message]
+    cmd = ['osascript', _get_script_path(), contact, message]
     try:
         result = subprocess.run(cmd, capture_output=True, text=True)
         if result.returncode == 0:
             print(f"消息已成功发送给 {contact}")
+            return True
         else:
-            print(f"发送失败: {result.stderr}")
+            logger.error(f"发送给 {contact} 失败: {result.stderr}")
     except Exception as e:
-        print(f"发送出错: {str(e)}")
+        logger.error(f"发送给 {contact} 出错: {str(e)}")
+    return False
+
+def send_imessage_many(pairs):
+    """
+    并行发送多条iMessage消息
+    
+    Args:
+        pairs (list): (联系人, 消息内容) 元组列表
+    
+    Returns:
+        list: 与pairs顺序对应的发送结果
+    """
+    return list(_send_pool.map(lambda pair: send_imessage(*pair), pairs))
 
 if __name__ == "__main__":
     # 示例使用
     contact = input("请输入联系人 (电话号码或 Apple ID): ")
     message = input("请输入要发送的消息: ")
-    send_imessage(contact, message) 
\ No newline at end of file
+    send_imessage(contact, message) 
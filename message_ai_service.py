@@ -1,9 +1,14 @@
 import requests
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_socketio import SocketIO, emit
 from imessage_sender import send_imessage
 from imessage_reader import iMessageReader
 import logging
+import logging.handlers
+import atexit
+import signal
+import sys
 import threading
 import time
 from datetime import datetime, timedelta
@@ -12,20 +17,177 @@ import json
 import os
 import sqlite3
 import re
-from dateutil import parser
+import contextlib
+import itertools
+import calendar
+import queue
+import concurrent.futures
+import functools
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_RUNNING
 from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.combining import OrTrigger
+from agents.cache import TTLCache, normalize_key
+from agents.http_client import SESSION, chat_completion, stream_chat_completion, loads as json_loads, dumps as json_dumps
+# 本模块另有同名的包装函数，这里使用别名导入
+from agents.agent_base import execute_agent_task as agent_execute_task, detect_and_execute_agent_task as agent_detect_and_execute
+from agents.agent_base import extract_json, detect_task_with_llm, CURRENT_CONTACT
+from agents.time_parser import parse_time_with_llm
 
-# 配置日志
+try:
+    # orjson为C扩展，序列化速度明显快于标准库json
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # 安装了eventlet时使用其异步服务器，Web请求和WebSocket连接不再各占一个线程
+    from eventlet import tpool
+    ASYNC_MODE = 'eventlet'
+except ImportError:
+    tpool = None
+    ASYNC_MODE = 'threading'
+
+# 日志队列容量，队列满时退回同步输出
+LOG_QUEUE_SIZE = 10000
+
+# 实际输出日志的处理器，由后台线程调用
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+class BufferedQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录放入队列由后台线程输出，队列已满时直接同步输出，不丢弃日志"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _log_handler.handle(record)
+
+# 配置日志，消息处理和任务执行线程只把记录放入队列，格式化和写stderr都在监听线程中完成
+# 入队时只合并消息文本，时间和级别等格式由监听线程中的处理器添加
+_queue_handler = BufferedQueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    handlers=[_queue_handler]
 )
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+# 退出时输出队列中剩余的日志
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """使用orjson进行序列化的Flask JSON提供器"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+class OrjsonCodec:
+    """供SocketIO使用的JSON编解码器，接口与json模块的dumps/loads一致"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-socketio = SocketIO(app)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+    socketio = SocketIO(app, async_mode=ASYNC_MODE, json=OrjsonCodec)
+else:
+    socketio = SocketIO(app, async_mode=ASYNC_MODE)
+
+def run_blocking(func, *args, **kwargs):
+    """
+    在Web请求中执行阻塞调用
+    
+    eventlet模式下放到线程池中执行，等待期间事件循环可以继续处理其他连接；
+    不做全局monkey_patch，消息监控、调度器和数据库写线程仍是真实线程
+    """
+    if tpool is not None:
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+# 当前时间字符串缓存（秒数, 格式化结果）
+_now_cache = (None, "")
+
+def _now_str():
+    """返回精确到秒的当前时间字符串，同一秒内只格式化一次"""
+    global _now_cache
+    second = int(time.time())
+    cached_second, text = _now_cache
+    if second != cached_second:
+        text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        _now_cache = (second, text)
+    return text
+
+# 当前连接的前端数量，没有前端连接时跳过推送
+_client_count = 0
+_client_lock = threading.Lock()
+
+@socketio.on('connect')
+def on_client_connect(auth=None):
+    """前端连接时计数"""
+    global _client_count
+    with _client_lock:
+        _client_count += 1
+
+@socketio.on('disconnect')
+def on_client_disconnect(*args):
+    """前端断开时计数"""
+    global _client_count
+    with _client_lock:
+        _client_count = max(0, _client_count - 1)
+
+def push_event(event, data):
+    """
+    向前端推送事件，没有前端连接时不做序列化和广播
+    
+    Args:
+        event (str): 事件名
+        data (dict): 事件数据
+    """
+    if _client_count:
+        socketio.emit(event, data)
+
+# 流式回复片段的最小推送间隔（秒），间隔内收到的片段合并为一次推送
+DELTA_PUSH_INTERVAL = 0.25
+
+class DeltaPusher:
+    """合并同一条流式回复的片段，按固定间隔推送给前端，避免逐个token广播占满WebSocket"""
+
+    def __init__(self, contact, interval=DELTA_PUSH_INTERVAL):
+        self.contact = contact
+        self.interval = interval
+        self._parts = []
+        self._last_push = 0.0
+
+    def __call__(self, delta):
+        """收到一个片段，距上次推送已超过间隔时把累积的片段一并推送"""
+        self._parts.append(delta)
+        now = time.monotonic()
+        if now - self._last_push >= self.interval:
+            self.flush()
+            self._last_push = now
+
+    def flush(self):
+        """推送尚未发送的片段"""
+        if self._parts:
+            push_event('new_message_delta', {'contact': self.contact, 'delta': ''.join(self._parts)})
+            self._parts.clear()
 
 # 数据文件路径
 DATA_DIR = "data"
@@ -36,22 +198,77 @@ TEMPLATE_FILE = os.path.join(DATA_DIR, "template.html")
 # 确保数据目录存在
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# SQLite 3.37起支持STRICT表，按声明类型严格存储，读取时无需做类型转换
+STRICT_TABLES = sqlite3.sqlite_version_info >= (3, 37, 0)
+
+# 消息历史表和调用历史表的结构，{name}为表名，{strict}为表选项
+MESSAGES_TABLE_SQL = '''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contact TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+        ){strict}
+    '''
+
+CALL_HISTORY_TABLE_SQL = '''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contact TEXT NOT NULL,
+            success INTEGER NOT NULL CHECK(success IN (0, 1)),
+            error TEXT,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+        ){strict}
+    '''
+
+def migrate_table_to_strict(c, table, create_sql, columns, select_exprs):
+    """
+    把已有的非STRICT表重建为STRICT表，保留原有数据
+    
+    Args:
+        c: 数据库游标
+        table (str): 表名
+        create_sql (str): 建表语句模板
+        columns (str): 需要迁移的列
+        select_exprs (str): 从旧表读取各列的表达式，与columns一一对应
+    """
+    row = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if not row or row[0].rstrip().upper().endswith('STRICT'):
+        return
+    
+    logger.info(f"正在将表 {table} 转换为STRICT表...")
+    new_table = f"{table}_new"
+    c.execute('BEGIN')
+    try:
+        c.execute(f'DROP TABLE IF EXISTS {new_table}')
+        c.execute(create_sql.format(name=new_table, strict=' STRICT'))
+        c.execute(f'INSERT INTO {new_table} ({columns}) SELECT {select_exprs} FROM {table}')
+        c.execute(f'DROP TABLE {table}')
+        c.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    logger.info(f"表 {table} 转换完成")
+
 # 数据库初始化
 def init_db():
     """初始化SQLite数据库"""
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     
+    # 使用增量自动清理，删除数据后可按页回收空间；只对尚未建表的新数据库生效，必须最先设置
+    c.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    
+    # 启用WAL模式，读写互不阻塞；journal_mode会持久化到数据库文件，建库时设置一次即可
+    c.execute('PRAGMA journal_mode=WAL')
+    c.execute('PRAGMA synchronous=NORMAL')
+    
+    strict = ' STRICT' if STRICT_TABLES else ''
+    
     # 创建消息历史表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            contact TEXT NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    c.execute(MESSAGES_TABLE_SQL.format(name='messages', strict=strict))
     
     # 创建定时任务表
     c.execute('''
@@ -73,15 +290,7 @@ def init_db():
     ''')
     
     # 创建调用历史表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS call_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            contact TEXT NOT NULL,
-            success BOOLEAN NOT NULL,
-            error TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    c.execute(CALL_HISTORY_TABLE_SQL.format(name='call_history', strict=strict))
     
     # 检查是否需要添加新列
     try:
@@ -93,71 +302,472 @@ def init_db():
         c.execute('ALTER TABLE scheduled_tasks ADD COLUMN task_params TEXT')
         logger.info("数据库结构更新完成")
     
+    # 旧版本创建的表转换为STRICT表，索引随旧表删除，在下方重新创建
+    if STRICT_TABLES:
+        try:
+            migrate_table_to_strict(
+                c, 'messages', MESSAGES_TABLE_SQL,
+                'id, contact, role, content, timestamp',
+                'id, CAST(contact AS TEXT), CAST(role AS TEXT), CAST(content AS TEXT), CAST(timestamp AS TEXT)'
+            )
+            migrate_table_to_strict(
+                c, 'call_history', CALL_HISTORY_TABLE_SQL,
+                'id, contact, success, error, timestamp',
+                'id, CAST(contact AS TEXT), CASE WHEN success THEN 1 ELSE 0 END, CAST(error AS TEXT), CAST(timestamp AS TEXT)'
+            )
+        except sqlite3.Error as e:
+            logger.error(f"转换STRICT表失败，继续使用原表结构: {str(e)}")
+
+    # 创建元数据表，保存上次清理时间等运行状态
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    
+    # 按联系人过滤并按时间排序的查询可直接走索引，无需全表扫描和临时排序
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_contact_ts ON messages(contact, timestamp DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_call_history_contact_ts ON call_history(contact, timestamp DESC)')
+    # 未执行任务按计划时间排序加载，索引同时满足过滤和排序
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_exec_time ON scheduled_tasks(executed, scheduled_time)')
+
     conn.commit()
+    
+    # 还没有统计信息时收集一次，查询规划器从第一条查询起就能正确选择索引；之后由PRAGMA optimize按需更新
+    if c.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        c.execute('ANALYZE')
+        conn.commit()
     conn.close()
 
 init_db()
 
+# 控制台每个联系人默认展示的最近消息数，更早的消息按需分页加载
+DASHBOARD_HISTORY_LIMIT = 50
+
+# 常用语句定义为模块常量，每次调用传入同一个SQL字符串，命中连接的已编译语句缓存
+INSERT_MESSAGE_SQL = 'INSERT INTO messages (contact, role, content) VALUES (?, ?, ?)'
+INSERT_CALL_RECORD_SQL = 'INSERT INTO call_history (contact, success, error) VALUES (?, ?, ?)'
+INSERT_TASK_SQL = (
+    'INSERT INTO scheduled_tasks (contact, message, scheduled_time, job_id, is_recurring, recurring_type, '
+    'recurring_value, next_run_time, task_type, task_params) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+SELECT_TASK_SQL = (
+    'SELECT id, contact, message, scheduled_time, is_recurring, recurring_type, recurring_value, '
+    'next_run_time, task_type, task_params FROM scheduled_tasks WHERE id = ?'
+)
+GET_TASK_BY_ID_SQL = (
+    'SELECT id, contact, message, scheduled_time, created_at, executed, job_id '
+    'FROM scheduled_tasks WHERE id = ?'
+)
+MARK_TASK_EXECUTED_SQL = 'UPDATE scheduled_tasks SET executed = 1 WHERE id = ?'
+# job_id未变化时不写入，避免重复注册同一任务时产生无意义的WAL写入；参数仍为(job_id, task_id)
+UPDATE_TASK_JOB_ID_SQL = 'UPDATE scheduled_tasks SET job_id = ?1 WHERE id = ?2 AND job_id IS NOT ?1'
+DELETE_TASK_SQL = 'DELETE FROM scheduled_tasks WHERE id = ?'
+
+def task_job_id(task_id):
+    """定时任务在调度器中的job_id，由任务ID确定"""
+    return f"task_{task_id}"
+
+# 写队列每批最多合并的写操作数，以及收到第一项后最多等待多久（秒）凑成一批
+WRITE_BATCH_SIZE = 256
+WRITE_LINGER = 0.05
+# 逐项写入时数据库被锁定的重试次数，以及每次重试递增的等待时间（秒）
+WRITE_RETRY_ATTEMPTS = 3
+WRITE_RETRY_DELAY = 0.1
+
+# 只读连接池大小
+READ_POOL_SIZE = max(4, os.cpu_count() or 1)
+
+# 写连接每归还多少次执行一次PRAGMA optimize，更新过期的统计信息
+OPTIMIZE_EVERY = 256
+
+# 每次增量回收的最大页数，避免长时间持有写锁；空闲页少于阈值时不回收
+VACUUM_MAX_PAGES = 1000
+VACUUM_MIN_FREE_PAGES = 100
+
+class ConnectionPool:
+    """SQLite连接池，连接预先创建并在线程间复用，避免每次操作都重新建立连接、解析schema"""
+
+    def __init__(self, db_file, size, query_only=False, optimize_every=0):
+        """
+        初始化连接池
+        
+        Args:
+            db_file (str): 数据库文件路径
+            size (int): 连接数
+            query_only (bool): 是否为只读连接
+            optimize_every (int): 每归还多少次连接执行一次PRAGMA optimize，为0时不执行；只读连接无法写入统计信息，不应设置
+        """
+        self._size = size
+        self._optimize_every = optimize_every
+        self._checkins = itertools.count(1)
+        self._pool = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._pool.put(self._connect(db_file, query_only))
+
+    @staticmethod
+    def _connect(db_file, query_only):
+        """创建一个设置好PRAGMA的连接"""
+        # 关闭sqlite3模块的隐式事务管理，由调用方显式BEGIN/COMMIT；
+        # 调大语句缓存，热路径上的SQL只需解析一次
+        conn = sqlite3.connect(db_file, timeout=5, check_same_thread=False,
+                               isolation_level=None, cached_statements=256)
+        # 以下PRAGMA只对当前连接生效，建立连接时设置一次即可
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('PRAGMA foreign_keys=ON')
+        if query_only:
+            conn.execute('PRAGMA query_only=1')
+        else:
+            # WAL文件每累积约1000页由写连接自动合并回数据库文件
+            conn.execute('PRAGMA wal_autocheckpoint=1000')
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """借出一个连接，代码块结束后归还；连接池为空时等待其他线程归还"""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            # 归还前清理未结束的事务，避免影响下一个使用者
+            if conn.in_transaction:
+                conn.rollback()
+            if self._optimize_every and next(self._checkins) % self._optimize_every == 0:
+                self._optimize(conn)
+            self._pool.put(conn)
+
+    @staticmethod
+    def _optimize(conn):
+        """对统计信息过期的表执行快速ANALYZE"""
+        try:
+            conn.execute('PRAGMA optimize')
+        except sqlite3.Error as e:
+            logger.warning(f"执行PRAGMA optimize失败: {str(e)}")
+
+    def close(self, timeout=None):
+        """
+        关闭池中的所有连接，关闭前执行一次PRAGMA optimize
+        
+        Args:
+            timeout (float): 等待借出的连接归还的最长秒数，为None时一直等待；超时仍未归还的连接不关闭，避免使用中的连接被关闭
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for closed in range(self._size):
+            try:
+                if deadline is None:
+                    conn = self._pool.get()
+                else:
+                    conn = self._pool.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                logger.warning(f"关闭连接池超时，{self._size - closed} 个连接仍未归还，已跳过")
+                return
+            if self._optimize_every:
+                self._optimize(conn)
+            conn.close()
+
+# 按过滤条件组合缓存的定时任务查询，SQL文本固定以便复用连接中已编译的语句
+_GET_TASKS_SQL = {}
+
+def build_get_tasks_sql(by_contact, include_executed, only_recurring):
+    """
+    构建定时任务查询语句
+    
+    Args:
+        by_contact (bool): 是否按联系人过滤
+        include_executed (bool): 是否包含已执行的任务
+        only_recurring (bool): 是否只查询循环任务
+        
+    Returns:
+        str: SQL语句，按联系人过滤时带一个参数
+    """
+    query_parts = []
+    if by_contact:
+        query_parts.append("contact = ?")
+    if not include_executed:
+        query_parts.append("executed = 0")
+    if only_recurring:
+        query_parts.append("is_recurring = 1")
+    
+    where_clause = ("WHERE " + " AND ".join(query_parts)) if query_parts else ""
+    return f'''
+        SELECT id, contact, message, scheduled_time, created_at, executed, job_id, 
+               is_recurring, recurring_type, recurring_value, next_run_time 
+        FROM scheduled_tasks 
+        {where_clause} 
+        ORDER BY scheduled_time
+    '''
+
 class MessageDB:
     def __init__(self):
         self.db_file = DB_FILE
+        # WAL模式已在init_db中启用；SQLite同一时刻只允许一个写事务，写连接只有一个；读连接多个，WAL模式下可并发读取
+        self._write_pool = ConnectionPool(self.db_file, 1, optimize_every=OPTIMIZE_EVERY)
+        self._read_pool = ConnectionPool(self.db_file, READ_POOL_SIZE, query_only=True)
+        # 记录当前线程已借出的写连接，嵌套使用时直接复用
+        self._local = threading.local()
+        # 数据版本号，每次增删数据时递增，用于判断页面缓存是否失效
+        self._version_counter = itertools.count(1)
+        self.version = 0
+        # 消息和调用记录的写入先放入队列，由单独的写线程批量提交，减少事务和fsync次数
+        self._write_q = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="MessageDBWriter", daemon=True)
+        self._writer.start()
+        
+    @contextlib.contextmanager
+    def get_connection(self, immediate=False):
+        """
+        借出写连接
+        
+        代码块在一个显式事务中执行，正常结束时提交，出现异常时回滚；
+        同一线程嵌套使用时复用已借出的连接，由最外层负责提交
+        
+        Args:
+            immediate (bool): 是否在事务开始时立即获取写锁（BEGIN IMMEDIATE）
+        """
+        conn = getattr(self._local, 'write_conn', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        with self._write_pool.connection() as conn:
+            self._local.write_conn = conn
+            try:
+                conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+                try:
+                    yield conn
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            finally:
+                self._local.write_conn = None
+
+    def read_connection(self):
+        """借出只读连接，用于不修改数据的查询"""
+        return self._read_pool.connection()
+    
+    def _writer_loop(self):
+        """
+        写线程：取出队列中的写操作，同一批在一个事务内用executemany提交
+        
+        队列中每一项是一组(sql, params)，同一项中的操作总在同一个事务里提交
+        """
+        while True:
+            batch = [self._write_q.get()]
+            # 短暂等待后续写入，把同一时段内的写操作合并到一个事务；总等待时间不超过WRITE_LINGER
+            deadline = time.monotonic() + WRITE_LINGER
+            try:
+                while len(batch) < WRITE_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._write_q.get(timeout=remaining))
+            except queue.Empty:
+                pass
+            
+            try:
+                # 一开始就获取写锁，避免事务中途升级写锁时与其他进程冲突
+                with self.get_connection(immediate=True) as conn:
+                    # 相邻的相同语句合并为一次executemany，保持写入顺序不变
+                    ops = itertools.chain.from_iterable(batch)
+                    for sql, items in itertools.groupby(ops, key=lambda op: op[0]):
+                        conn.executemany(sql, [params for _, params in items])
+            except Exception as e:
+                # 整批已回滚，逐项重新写入，只丢弃本身出错的那一项
+                logger.warning(f"批量写入数据库时出错，改为逐项写入: {str(e)}")
+                for item in batch:
+                    self._write_item(item)
+            finally:
+                for _ in batch:
+                    self._write_q.task_done()
+    
+    def _write_item(self, item):
+        """
+        在单独的事务中写入队列中的一项，数据库被锁定时短暂等待后重试
         
-    def get_connection(self):
-        return sqlite3.connect(self.db_file)
+        Args:
+            item (tuple): 一组(sql, params)，params的第一个字段为联系人
+        """
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                with self.get_connection(immediate=True) as conn:
+                    for sql, params in item:
+                        conn.execute(sql, params)
+                return
+            except sqlite3.OperationalError as e:
+                if attempt + 1 < WRITE_RETRY_ATTEMPTS and 'locked' in str(e):
+                    time.sleep(WRITE_RETRY_DELAY * (attempt + 1))
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            break
+        logger.error(f"写入数据库失败，已丢弃联系人 {item[0][1][0]} 的 {len(item)} 条记录: {str(error)}")
+    
+    def _bump_version(self):
+        """数据发生变化，更新版本号"""
+        self.version = next(self._version_counter)
+    
+    def flush(self, timeout=None):
+        """
+        等待写队列中的操作全部落库，读取前调用以保证读到最新数据
+        
+        Args:
+            timeout (float): 最长等待秒数，为None时一直等待
+            
+        Returns:
+            bool: 队列中的操作是否已全部落库
+        """
+        if timeout is None:
+            self._write_q.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._write_q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._write_q.unfinished_tasks
     
     def add_message(self, contact, role, content):
         """添加新消息"""
-        with self.get_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                'INSERT INTO messages (contact, role, content) VALUES (?, ?, ?)',
-                (contact, role, content)
-            )
+        self._write_q.put((
+            (INSERT_MESSAGE_SQL, (contact, role, content)),
+        ))
+        self._bump_version()
+    
+    def add_turn(self, contact, user_text, assistant_text):
+        """
+        保存一轮对话，用户消息和回复在同一个事务中写入
+        
+        Args:
+            contact (str): 联系人
+            user_text (str): 用户消息
+            assistant_text (str): 回复内容
+        """
+        self._write_q.put((
+            (INSERT_MESSAGE_SQL, (contact, "user", user_text)),
+            (INSERT_MESSAGE_SQL, (contact, "assistant", assistant_text)),
+        ))
+        self._bump_version()
     
     def add_call_record(self, contact, success, error=None):
         """添加调用记录"""
-        with self.get_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                'INSERT INTO call_history (contact, success, error) VALUES (?, ?, ?)',
-                (contact, success, error)
-            )
+        self._write_q.put((
+            (INSERT_CALL_RECORD_SQL, (contact, 1 if success else 0, error)),
+        ))
+        self._bump_version()
     
     def get_messages(self, contact, limit=None):
         """获取指定联系人的消息历史"""
-        with self.get_connection() as conn:
+        self.flush()
+        with self.read_connection() as conn:
             c = conn.cursor()
             if limit:
+                # 子查询按索引倒序取最近的limit条，外层再恢复正序，无需在Python中反转列表
                 c.execute(
-                    'SELECT role, content FROM messages WHERE contact = ? ORDER BY timestamp DESC LIMIT ?',
+                    '''SELECT role, content FROM (
+                           SELECT id, role, content, timestamp FROM messages
+                           WHERE contact = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+                       ) ORDER BY timestamp, id''',
                     (contact, limit)
                 )
             else:
                 c.execute(
-                    'SELECT role, content FROM messages WHERE contact = ? ORDER BY timestamp DESC',
+                    'SELECT role, content FROM messages WHERE contact = ? ORDER BY timestamp, id',
                     (contact,)
                 )
-            return [{"role": role, "content": content} for role, content in c.fetchall()][::-1]
+            return [{"role": role, "content": content} for role, content in c]
     
     def get_all_contacts_with_stats(self):
         """获取所有联系人及其统计信息"""
-        with self.get_connection() as conn:
+        self.flush()
+        with self.read_connection() as conn:
             c = conn.cursor()
-            # 获取每个联系人的消息数和最后通话记录
+            # 先按联系人聚合消息数，再关联每个联系人的最近一条调用记录和调用总数，避免两表JOIN后行数相乘导致计数偏大
             c.execute('''
                 SELECT m.contact,
-                       COUNT(m.id) as message_count,
-                       MAX(ch.timestamp) as last_call,
+                       m.message_count,
+                       ch.timestamp as last_call,
                        ch.success as last_call_success,
-                       ch.error as last_call_error
-                FROM messages m
-                LEFT JOIN call_history ch ON m.contact = ch.contact
-                GROUP BY m.contact
+                       ch.error as last_call_error,
+                       (SELECT COUNT(*) FROM call_history WHERE contact = m.contact) AS call_count
+                FROM (SELECT contact, COUNT(*) AS message_count FROM messages GROUP BY contact) m
+                LEFT JOIN call_history ch ON ch.id = (
+                    SELECT id FROM call_history
+                    WHERE contact = m.contact
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT 1
+                )
             ''')
             return c.fetchall()
     
+    def get_all_messages(self, limit=DASHBOARD_HISTORY_LIMIT):
+        """
+        一次查询获取所有联系人最近的消息历史
+        
+        Args:
+            limit (int): 每个联系人最多返回的消息数
+            
+        Returns:
+            dict: 联系人到消息列表的映射，消息按时间正序排列
+        """
+        self.flush()
+        with self.read_connection() as conn:
+            c = conn.cursor()
+            # 按联系人分区编号，只取每个联系人最近的limit条
+            c.execute('''
+                SELECT contact, id, role, content FROM (
+                    SELECT contact, id, role, content, timestamp,
+                           ROW_NUMBER() OVER (PARTITION BY contact ORDER BY timestamp DESC, id DESC) AS rn
+                    FROM messages
+                )
+                WHERE rn <= ?
+                ORDER BY contact, timestamp, id
+            ''', (limit,))
+            return {
+                contact: [{"id": msg_id, "role": role, "content": content} for _, msg_id, role, content in rows]
+                for contact, rows in itertools.groupby(c, key=lambda row: row[0])
+            }
+    
+    def get_messages_before(self, contact, before_id=None, limit=DASHBOARD_HISTORY_LIMIT):
+        """
+        分页获取指定联系人更早的消息
+        
+        Args:
+            contact (str): 联系人
+            before_id (int): 只返回ID小于该值的消息，为空时从最新消息开始
+            limit (int): 最多返回的消息数
+            
+        Returns:
+            list: 消息列表，按时间正序排列
+        """
+        self.flush()
+        with self.read_connection() as conn:
+            c = conn.cursor()
+            if before_id is not None:
+                c.execute(
+                    '''SELECT id, role, content FROM (
+                           SELECT id, role, content FROM messages
+                           WHERE contact = ? AND id < ? ORDER BY id DESC LIMIT ?
+                       ) ORDER BY id''',
+                    (contact, before_id, limit)
+                )
+            else:
+                c.execute(
+                    '''SELECT id, role, content FROM (
+                           SELECT id, role, content FROM messages
+                           WHERE contact = ? ORDER BY id DESC LIMIT ?
+                       ) ORDER BY id''',
+                    (contact, limit)
+                )
+            return [{"id": msg_id, "role": role, "content": content} for msg_id, role, content in c]
+    
     def clear_history(self, contact=None):
         """清除历史记录"""
+        self.flush()
         with self.get_connection() as conn:
             c = conn.cursor()
             if contact:
@@ -166,101 +776,268 @@ class MessageDB:
             else:
                 c.execute('DELETE FROM messages')
                 c.execute('DELETE FROM call_history')
+        self._bump_version()
     
     def cleanup_old_data(self, days=30):
-        """清理指定天数之前的数据"""
-        with self.get_connection() as conn:
+        """
+        清理指定天数之前的数据
+        
+        Args:
+            days (int): 保留的天数
+            
+        Returns:
+            int: 删除的总行数
+        """
+        self.flush()
+        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        # 三条删除语句在同一个事务中提交，只产生一次fsync
+        with self.get_connection(immediate=True) as conn:
             c = conn.cursor()
-            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
-            c.execute('DELETE FROM messages WHERE timestamp < ?', (cutoff_date,))
-            c.execute('DELETE FROM call_history WHERE timestamp < ?', (cutoff_date,))
-            c.execute('DELETE FROM scheduled_tasks WHERE executed = 1 AND scheduled_time < ?', (cutoff_date,))
+            cleaned = 0
+            for sql in (
+                'DELETE FROM messages WHERE timestamp < ?',
+                'DELETE FROM call_history WHERE timestamp < ?',
+                'DELETE FROM scheduled_tasks WHERE executed = 1 AND scheduled_time < ?',
+            ):
+                c.execute(sql, (cutoff_date,))
+                cleaned += c.rowcount
+        self._bump_version()
+        return cleaned
+    
+    def get_meta(self, key, default=None):
+        """读取元数据"""
+        with self.read_connection() as conn:
+            row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+            return row[0] if row else default
+    
+    def set_meta(self, key, value):
+        """写入元数据"""
+        with self.get_connection() as conn:
+            conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (key, value)
+            )
+    
+    def incremental_vacuum(self, max_pages=VACUUM_MAX_PAGES):
+        """
+        回收已删除数据占用的空闲页
+        
+        Args:
+            max_pages (int): 本次最多回收的页数
+            
+        Returns:
+            int: 回收前的空闲页数
+        """
+        with self.get_connection() as conn:
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if free_pages >= VACUUM_MIN_FREE_PAGES:
+                # execute()只单步执行一次（每次只回收一页），用executescript让语句执行到底
+                conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+            return free_pages
+    
+    def close(self, timeout=None):
+        """
+        写入队列中剩余的数据后关闭所有连接
+        
+        Args:
+            timeout (float): 整个关闭过程的最长秒数，为None时一直等待
+        """
+        if timeout is None:
+            self.flush()
+            self._write_pool.close()
+            self._read_pool.close()
+            return
+        deadline = time.monotonic() + timeout
+        if not self.flush(timeout):
+            logger.warning(f"关闭超时，{self._write_q.unfinished_tasks} 项写入未落库")
+        self._write_pool.close(max(0, deadline - time.monotonic()))
+        self._read_pool.close(max(0, deadline - time.monotonic()))
+    
+    def checkpoint(self):
+        """把WAL中的内容合并回数据库文件并截断WAL文件；不能在事务中执行，直接借用写连接"""
+        with self._write_pool.connection() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
     
     def add_scheduled_task(self, contact, message, scheduled_time, job_id=None, is_recurring=False, recurring_type=None, recurring_value=None, next_run_time=None, task_type=None, task_params=None):
-        """添加定时任务"""
+        """添加定时任务，未指定job_id时按任务ID生成，与插入在同一个事务中写入"""
         with self.get_connection() as conn:
             c = conn.cursor()
             c.execute(
-                'INSERT INTO scheduled_tasks (contact, message, scheduled_time, job_id, is_recurring, recurring_type, recurring_value, next_run_time, task_type, task_params) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                INSERT_TASK_SQL,
                 (contact, message, scheduled_time, job_id, is_recurring, recurring_type, recurring_value, next_run_time, task_type, task_params)
             )
-            return c.lastrowid
+            task_id = c.lastrowid
+            if job_id is None:
+                c.execute(UPDATE_TASK_JOB_ID_SQL, (task_job_id(task_id), task_id))
+            return task_id
+    
+    def add_scheduled_tasks_bulk(self, rows):
+        """
+        在一个事务中批量添加定时任务，job_id按任务ID生成
+        
+        Args:
+            rows (list): (contact, message, scheduled_time, is_recurring, recurring_type, recurring_value,
+                next_run_time, task_type, task_params)元组列表
+            
+        Returns:
+            list: 与rows顺序一致的任务ID列表
+        """
+        if not rows:
+            return []
+        with self.get_connection(immediate=True) as conn:
+            c = conn.cursor()
+            task_ids = []
+            for contact, message, scheduled_time, *rest in rows:
+                c.execute(INSERT_TASK_SQL, (contact, message, scheduled_time, None, *rest))
+                task_ids.append(c.lastrowid)
+            c.executemany(UPDATE_TASK_JOB_ID_SQL, [(task_job_id(task_id), task_id) for task_id in task_ids])
+            return task_ids
     
     def get_scheduled_tasks(self, contact=None, include_executed=False, only_recurring=False):
         """获取定时任务"""
-        with self.get_connection() as conn:
+        key = (bool(contact), bool(include_executed), bool(only_recurring))
+        query = _GET_TASKS_SQL.get(key)
+        if query is None:
+            query = _GET_TASKS_SQL[key] = build_get_tasks_sql(*key)
+        with self.read_connection() as conn:
             c = conn.cursor()
-            query_parts = []
-            params = []
-            
-            if contact:
-                query_parts.append("contact = ?")
-                params.append(contact)
-            
-            if not include_executed:
-                query_parts.append("executed = 0")
-            
-            if only_recurring:
-                query_parts.append("is_recurring = 1")
-            
-            where_clause = " AND ".join(query_parts) if query_parts else ""
-            if where_clause:
-                where_clause = "WHERE " + where_clause
-            
-            query = f'''
-                SELECT id, contact, message, scheduled_time, created_at, executed, job_id, 
-                       is_recurring, recurring_type, recurring_value, next_run_time 
-                FROM scheduled_tasks 
-                {where_clause} 
-                ORDER BY scheduled_time
-            '''
-            
-            c.execute(query, params)
+            c.execute(query, (contact,) if contact else ())
             return c.fetchall()
     
+    def get_task_by_id(self, task_id):
+        """按主键获取单个定时任务，不存在时返回None"""
+        with self.read_connection() as conn:
+            return conn.execute(GET_TASK_BY_ID_SQL, (task_id,)).fetchone()
+    
     def mark_task_executed(self, task_id):
         """标记任务已执行"""
         with self.get_connection() as conn:
             c = conn.cursor()
-            c.execute(
-                'UPDATE scheduled_tasks SET executed = 1 WHERE id = ?',
-                (task_id,)
-            )
+            c.execute(MARK_TASK_EXECUTED_SQL, (task_id,))
     
     def update_task_job_id(self, task_id, job_id):
         """更新任务的job_id"""
         with self.get_connection() as conn:
             c = conn.cursor()
-            c.execute(
-                'UPDATE scheduled_tasks SET job_id = ? WHERE id = ?',
-                (job_id, task_id)
-            )
+            c.execute(UPDATE_TASK_JOB_ID_SQL, (job_id, task_id))
+    
+    def update_many_task_job_ids(self, pairs):
+        """
+        在一个事务中批量更新任务的job_id
+        
+        Args:
+            pairs (list): (job_id, task_id)元组列表
+        """
+        if not pairs:
+            return
+        with self.get_connection(immediate=True) as conn:
+            conn.executemany(UPDATE_TASK_JOB_ID_SQL, pairs)
     
     def delete_task(self, task_id):
         """删除任务"""
         with self.get_connection() as conn:
             c = conn.cursor()
-            c.execute(
-                'DELETE FROM scheduled_tasks WHERE id = ?',
-                (task_id,)
-            )
+            c.execute(DELETE_TASK_SQL, (task_id,))
 
 # 创建数据库实例
 db = MessageDB()
 
+# 调度器线程数：维护类任务使用default，定时任务使用io；定时任务主要在等待天气、新闻等接口响应，
+# 发送统一交给发送线程逐条完成，因此io按网络并发而不是按发送数设置，一个慢请求不会拖延其他任务
+SCHEDULER_WORKERS = min(32, (os.cpu_count() or 4) * 2)
+SCHEDULER_IO_WORKERS = 32
+# 调度器繁忙或进程短暂挂起时，错过执行时间不超过该秒数的任务仍会执行
+SCHEDULER_MISFIRE_GRACE_TIME = 60
+
 # 初始化任务调度器
 jobstores = {
     'default': MemoryJobStore()
 }
 executors = {
-    'default': ThreadPoolExecutor(20)
+    'default': ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS),
+    'io': ThreadPoolExecutor(max_workers=SCHEDULER_IO_WORKERS)
 }
 job_defaults = {
-    'coalesce': False,
-    'max_instances': 3
+    # 错过的多次执行合并为一次
+    'coalesce': True,
+    'max_instances': 3,
+    'misfire_grace_time': SCHEDULER_MISFIRE_GRACE_TIME
 }
 scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors, job_defaults=job_defaults)
 
+def _monthly_trigger(value, start):
+    """
+    每N个月在同一日期、时刻触发的触发器，从首次执行的月份起计算（N不能整除12时按年重新对齐）；
+    当月没有该日期时（如31日、2月29日）在当月最后一天触发
+    
+    Args:
+        value (int): 间隔月数
+        start (datetime): 首次执行时间
+        
+    Returns:
+        触发器
+    """
+    months = range((start.month - 1) % value + 1, 13, value)
+    at = dict(hour=start.hour, minute=start.minute, second=start.second, start_date=start)
+    trigger = CronTrigger(month=','.join(map(str, months)), day=start.day, **at)
+    # 按平年计算天数不足的月份，闰年2月29日两个触发器同时命中，只触发一次
+    short_months = [m for m in months if calendar.monthrange(2001, m)[1] < start.day]
+    if not short_months:
+        return trigger
+    return OrTrigger([trigger, CronTrigger(month=','.join(map(str, short_months)), day='last', **at)])
+
+# 循环类型到调度触发器的映射，由调度器自行推算每次的执行时间
+_RECUR = {
+    'minutely': lambda value, start: IntervalTrigger(minutes=value, start_date=start),
+    'hourly': lambda value, start: IntervalTrigger(hours=value, start_date=start),
+    'daily': lambda value, start: IntervalTrigger(days=value, start_date=start),
+    'weekly': lambda value, start: IntervalTrigger(weeks=value, start_date=start),
+    'monthly': _monthly_trigger,
+}
+
+def schedule_task_job(task_id, contact, message, run_time, is_recurring=False, recurring_type=None, recurring_value=None):
+    """
+    把任务加入调度器，循环任务使用循环触发器，只需添加一次
+    
+    Args:
+        task_id: 任务ID
+        contact: 联系人
+        message: 消息内容
+        run_time (datetime): 首次执行时间
+        is_recurring: 是否是循环任务
+        recurring_type: 循环类型
+        recurring_value: 循环值
+        
+    Returns:
+        Job: 调度器中的任务
+    """
+    make_trigger = _RECUR.get(recurring_type) if is_recurring and recurring_value else None
+    if make_trigger:
+        trigger = make_trigger(int(recurring_value), run_time)
+    else:
+        if is_recurring:
+            logger.warning(f"未知的循环类型: {recurring_type}，任务 {task_id} 只执行一次")
+        trigger = DateTrigger(run_date=run_time)
+    
+    return scheduler.add_job(
+        execute_scheduled_task,
+        trigger,
+        args=[task_id, contact, message],
+        id=task_job_id(task_id),
+        executor='io',
+        replace_existing=True
+    )
+
+# 可能包含自动化任务的提示词（覆盖agent_base中各识别规则的触发词以及数字表达式），
+# 不含任何提示词的普通提醒直接发送，不再进入任务识别和大模型分类
+# 定时任务的消息默认带有"提醒消息"前缀，因此不把"提醒"作为提示词
+_AGENT_HINT_RE = re.compile(
+    r'查询|查看|获取|搜索|查找|了解|知道|告诉我|是什么|怎么样|如何|天气|气温|温度|下雨|下雪|新闻|资讯|热点|'
+    r'股|汇率|比特币|货币|兑换|转换|换成|等于|多少|计算|翻译|\d|/g |'
+    r'search|weather|news|translate',
+    re.IGNORECASE
+)
+
 # 任务执行函数
 def execute_scheduled_task(task_id, contact, message):
     """执行定时任务"""
@@ -269,12 +1046,9 @@ def execute_scheduled_task(task_id, contact, message):
         logger.info(f"[DEBUG] 任务内容分析: 消息类型={type(message)}, 消息内容={message}")
         
         # 获取任务详情
-        with db.get_connection() as conn:
+        with db.read_connection() as conn:
             c = conn.cursor()
-            c.execute('''
-                SELECT id, contact, message, scheduled_time, is_recurring, recurring_type, recurring_value, next_run_time, task_type, task_params 
-                FROM scheduled_tasks WHERE id = ?
-            ''', (task_id,))
+            c.execute(SELECT_TASK_SQL, (task_id,))
             task = c.fetchone()
             if task:
                 logger.info(f"任务详情: {task}")
@@ -299,11 +1073,10 @@ def execute_scheduled_task(task_id, contact, message):
             logger.info(f"执行自动化任务: {task_type}, 参数: {task_params}")
             try:
                 # 解析任务参数
-                params = json.loads(task_params) if task_params else {}
+                params = json_loads(task_params) if task_params else {}
                 
                 # 执行自动化任务
-                from agents.agent_base import execute_agent_task
-                response_message = execute_agent_task(task_type, params, contact, config)
+                response_message = agent_execute_task(task_type, params, contact, config)
                 logger.info(f"自动化任务执行结果: {response_message}")
             except Exception as e:
                 logger.error(f"执行自动化任务时出错: {str(e)}")
@@ -311,71 +1084,36 @@ def execute_scheduled_task(task_id, contact, message):
         else:
             # 尝试检测消息中是否包含需要执行的任务
             logger.info(f"[DEBUG] 尝试检测消息中是否包含需要执行的任务: {message}")
-            from agents.agent_base import detect_and_execute_agent_task
-            task_response = detect_and_execute_agent_task(message, contact, config)
+            task_response = agent_detect_and_execute(message, contact, config) if _AGENT_HINT_RE.search(message) else None
             if task_response:
                 logger.info(f"[DEBUG] 检测到任务并执行，结果: {task_response}")
                 response_message = task_response
             else:
                 logger.info(f"[DEBUG] 未检测到任务，将直接发送原始消息")
         
-        # 发送消息
-        send_imessage(contact, response_message)
-        logger.info(f"消息已发送给 {contact}")
+        # 放入发送队列，由发送线程逐条发送
+        queue_imessage(contact, response_message)
+        logger.info(f"消息已加入发送队列: {contact}")
         
-        # 处理循环任务
-        if is_recurring and recurring_type and recurring_value:
-            logger.info(f"这是一个循环任务，类型: {recurring_type}，值: {recurring_value}")
-            
-            # 计算下一次执行时间
-            current_time = datetime.now()
-            if recurring_type == 'daily':
-                next_time = current_time + timedelta(days=recurring_value)
-            elif recurring_type == 'weekly':
-                next_time = current_time + timedelta(weeks=recurring_value)
-            elif recurring_type == 'monthly':
-                # 简单处理，不考虑月份天数不同的情况
-                next_time = current_time + timedelta(days=30 * recurring_value)
-            elif recurring_type == 'hourly':
-                next_time = current_time + timedelta(hours=recurring_value)
-            elif recurring_type == 'minutely':
-                next_time = current_time + timedelta(minutes=recurring_value)
-            else:
-                logger.warning(f"未知的循环类型: {recurring_type}")
-                next_time = None
-            
-            if next_time:
-                # 更新任务的下一次执行时间
-                with db.get_connection() as conn:
-                    c = conn.cursor()
-                    c.execute(
-                        'UPDATE scheduled_tasks SET next_run_time = ? WHERE id = ?',
-                        (next_time.strftime("%Y-%m-%d %H:%M:%S"), task_id)
-                    )
-                
-                # 添加新的调度任务
-                job = scheduler.add_job(
-                    execute_scheduled_task,
-                    'date',
-                    run_date=next_time,
-                    args=[task_id, contact, message],
-                    id=f"task_{task_id}_{next_time.strftime('%Y%m%d%H%M%S')}"
-                )
-                
-                logger.info(f"已为循环任务 {task_id} 安排下一次执行时间: {next_time}")
+        # 处理循环任务，下一次执行由循环触发器负责，无需重新添加任务
+        next_time = None
+        if is_recurring and recurring_type in _RECUR and recurring_value:
+            job = scheduler.get_job(task_job_id(task_id))
+            next_time = job.next_run_time if job else None
+            logger.info(f"这是一个循环任务，类型: {recurring_type}，值: {recurring_value}，下一次执行时间: {next_time}")
         else:
             # 非循环任务，标记为已执行
             db.mark_task_executed(task_id)
             logger.info(f"非循环任务 {task_id} 已标记为已执行")
         
         # 发送任务执行通知
-        socketio.emit('task_executed', {
+        push_event('task_executed', {
             'task_id': task_id,
             'contact': contact,
             'message': response_message,
-            'executed_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'executed_at': _now_str(),
             'is_recurring': bool(is_recurring),
-            'next_run_time': next_time.strftime("%Y-%m-%d %H:%M:%S") if is_recurring and 'next_time' in locals() and next_time else None,
+            'next_run_time': next_time.strftime("%Y-%m-%d %H:%M:%S") if next_time else None,
             'task_type': task_type
         })
         logger.info(f"已发送任务执行通知")
@@ -388,36 +1126,33 @@ def load_scheduled_tasks():
     tasks = db.get_scheduled_tasks()
     loaded_count = 0
     recurring_count = 0
+    # 加载完成后一次性写回所有任务的job_id
+    job_ids = []
     
     for task in tasks:
         if len(task) >= 11:  # 确保任务包含所有字段
-            task_id, contact, message, scheduled_time, _, executed, _, is_recurring, recurring_type, recurring_value, next_run_time = task
+            task_id, contact, message, scheduled_time, _, executed, job_id, is_recurring, recurring_type, recurring_value, next_run_time = task
         else:
             # 兼容旧版本数据
-            task_id, contact, message, scheduled_time, _, executed, _ = task
+            task_id, contact, message, scheduled_time, _, executed, job_id = task
             is_recurring = False
             recurring_type = None
             recurring_value = None
             next_run_time = None
         
-        # 确定运行时间
-        if is_recurring and next_run_time:
-            run_time = parser.parse(next_run_time)
-            logger.info(f"加载循环任务 {task_id}，下一次执行时间: {run_time}")
+        # 循环触发器从首次执行时间起推算，过去的起点同样有效；数据库中的时间统一为"%Y-%m-%d %H:%M:%S"格式
+        run_time = datetime.fromisoformat(scheduled_time)
+        if is_recurring:
+            logger.info(f"加载循环任务 {task_id}，首次执行时间: {run_time}")
         else:
-            run_time = parser.parse(scheduled_time)
             logger.info(f"加载一次性任务 {task_id}，执行时间: {run_time}")
         
-        # 只加载未来的任务
-        if run_time > datetime.now():
-            job = scheduler.add_job(
-                execute_scheduled_task,
-                'date',
-                run_date=run_time,
-                args=[task_id, contact, message],
-                id=f"task_{task_id}" if not is_recurring else f"task_{task_id}_{run_time.strftime('%Y%m%d%H%M%S')}"
-            )
-            db.update_task_job_id(task_id, job.id)
+        # 一次性任务只加载未来的
+        if is_recurring or run_time > datetime.now():
+            job = schedule_task_job(task_id, contact, message, run_time, is_recurring, recurring_type, recurring_value)
+            # 只写回与数据库中不一致的job_id
+            if job.id != job_id:
+                job_ids.append((job.id, task_id))
             
             if is_recurring:
                 recurring_count += 1
@@ -426,27 +1161,51 @@ def load_scheduled_tasks():
                 
             logger.info(f"已加载任务 {task_id}: 将在 {run_time} 向 {contact} 发送消息")
     
+    db.update_many_task_job_ids(job_ids)
     logger.info(f"共加载了 {loaded_count} 个一次性任务和 {recurring_count} 个循环任务")
 
 # 启动调度器
 scheduler.start()
 load_scheduled_tasks()
 
+# 数据保留天数和清理周期
+CLEANUP_RETENTION_DAYS = 30
+CLEANUP_INTERVAL = timedelta(days=1)
+# 每天执行清理的时刻（本地时间）
+CLEANUP_HOUR = 3
+
 # 自动清理数据的函数
 def auto_cleanup_data():
-    while True:
-        try:
-            # 每天清理一次30天前的数据
-            cleaned = db.cleanup_old_data(days=30)
-            if cleaned > 0:
-                logger.info(f"已清理 {cleaned} 条旧数据")
-        except Exception as e:
-            logger.error(f"清理数据时出错: {str(e)}")
-        time.sleep(86400)  # 24小时
+    """清理过期数据并回收空间，完成后记录清理时间"""
+    try:
+        cleaned = db.cleanup_old_data(days=CLEANUP_RETENTION_DAYS)
+        # 删除后按页上限增量回收空间，不做会长时间锁库的完整VACUUM
+        db.incremental_vacuum()
+        db.set_meta('last_cleanup_at', _now_str())
+        # 清理产生的WAL内容合并后截断，释放磁盘空间
+        db.checkpoint()
+        if cleaned:
+            logger.info(f"已清理 {cleaned} 条旧数据")
+    except Exception as e:
+        logger.error(f"清理数据时出错: {str(e)}")
+
+def schedule_auto_cleanup():
+    """每天定时清理数据；如果距上次清理已超过一个周期，启动时立即补做一次"""
+    scheduler.add_job(
+        auto_cleanup_data,
+        'cron',
+        hour=CLEANUP_HOUR,
+        id='auto_cleanup',
+        replace_existing=True,
+        coalesce=True
+    )
+    
+    last_cleanup_at = db.get_meta('last_cleanup_at')
+    if not last_cleanup_at or datetime.now() - datetime.fromisoformat(last_cleanup_at) > CLEANUP_INTERVAL:
+        logger.info(f"上次清理时间: {last_cleanup_at}，立即执行一次清理")
+        scheduler.add_job(auto_cleanup_data, id='auto_cleanup_overdue', replace_existing=True)
 
-# 启动自动清理线程
-cleanup_thread = threading.Thread(target=auto_cleanup_data, daemon=True)
-cleanup_thread.start()
+schedule_auto_cleanup()
 
 # 默认HTML模板
 DEFAULT_TEMPLATE = """
@@ -529,9 +1288,12 @@ DEFAULT_TEMPLATE = """
                 <div class="contact-item" id="contact-{{ contact }}">
                     <h3>联系人: {{ contact }}</h3>
                     <button onclick="clearHistory('{{ contact }}')">清除此联系人历史</button>
+                    {% if messages|length >= history_limit %}
+                    <button class="load-more" onclick="loadMoreMessages('{{ contact }}')">加载更早的消息</button>
+                    {% endif %}
                     <div class="messages">
                         {% for msg in messages %}
-                        <div class="message-item {{ msg.role }}">
+                        <div class="message-item {{ msg.role }}" data-id="{{ msg.id }}">
                             <strong>{{ msg.role }}:</strong> {{ msg.content }}
                         </div>
                         {% endfor %}
@@ -546,11 +1308,11 @@ DEFAULT_TEMPLATE = """
             <h2>调用统计</h2>
             <div id="callStats">
                 {% for contact, calls in call_history.items() %}
-                <div class="contact-item">
+                <div class="contact-item" id="call-{{ contact }}">
                     <h3>联系人: {{ contact }}</h3>
-                    <p>总调用次数: {{ calls|length }}</p>
+                    <p>总调用次数: <span class="call-count">{{ calls[-1].count if calls else 0 }}</span></p>
                     {% if calls %}
-                    <p>最后调用时间: {{ calls[-1].time }}</p>
+                    <p>最后调用时间: <span class="call-time">{{ calls[-1].time }}</span></p>
                     <div class="call-status {{ 'success' if calls[-1].success else 'error' }}">
                         状态: {{ '成功' if calls[-1].success else '失败 - ' + calls[-1].error }}
                     </div>
@@ -596,6 +1358,11 @@ DEFAULT_TEMPLATE = """
             }
             
             const messagesDiv = contactDiv.querySelector('.messages');
+            // 完整回复到达后替换流式生成中的临时消息
+            const streamingDiv = messagesDiv.querySelector('.message-item.streaming');
+            if (streamingDiv && data.role === 'assistant') {
+                streamingDiv.remove();
+            }
             const messageDiv = document.createElement('div');
             messageDiv.className = `message-item ${data.role}`;
             messageDiv.innerHTML = `<strong>${data.role}:</strong> ${data.content}`;
@@ -603,9 +1370,46 @@ DEFAULT_TEMPLATE = """
             messageDiv.scrollIntoView({ behavior: 'smooth' });
         });
         
+        socket.on('new_message_delta', (data) => {
+            // 流式回复片段，追加到该联系人正在生成的临时消息中
+            const contactDiv = document.getElementById(`contact-${data.contact}`);
+            if (!contactDiv) {
+                return;
+            }
+            const messagesDiv = contactDiv.querySelector('.messages');
+            let streamingDiv = messagesDiv.querySelector('.message-item.streaming');
+            if (!streamingDiv) {
+                streamingDiv = document.createElement('div');
+                streamingDiv.className = 'message-item assistant streaming';
+                streamingDiv.innerHTML = '<strong>assistant:</strong> <span class="content"></span>';
+                messagesDiv.appendChild(streamingDiv);
+            }
+            streamingDiv.querySelector('.content').textContent += data.delta;
+        });
+        
         socket.on('call_update', (data) => {
-            // 更新调用统计
-            location.reload();  // 简单起见，直接刷新页面
+            // 只更新对应联系人的调用统计，不再刷新整个页面
+            let callDiv = document.getElementById(`call-${data.contact}`);
+            if (!callDiv) {
+                callDiv = document.createElement('div');
+                callDiv.id = `call-${data.contact}`;
+                callDiv.className = 'contact-item';
+                callDiv.innerHTML = `
+                    <h3>联系人: ${data.contact}</h3>
+                    <p>总调用次数: <span class="call-count">0</span></p>
+                    <p>最后调用时间: <span class="call-time"></span></p>
+                    <div class="call-status"></div>
+                `;
+                document.getElementById('callStats').appendChild(callDiv);
+            }
+            
+            const countSpan = callDiv.querySelector('.call-count');
+            countSpan.textContent = (parseInt(countSpan.textContent, 10) || 0) + 1;
+            callDiv.querySelector('.call-time').textContent = data.time;
+            
+            const statusDiv = callDiv.querySelector('.call-status');
+            statusDiv.className = `call-status ${data.success ? 'success' : 'error'}`;
+            statusDiv.textContent = data.success ? '状态: 成功' : `状态: 失败 - ${data.error}`;
         });
 
         function updateConfig() {
@@ -631,6 +1435,40 @@ DEFAULT_TEMPLATE = """
             });
         }
 
+        function loadMoreMessages(contact) {
+            const contactDiv = document.getElementById(`contact-${contact}`);
+            const messagesDiv = contactDiv.querySelector('.messages');
+            const firstMessage = messagesDiv.querySelector('.message-item[data-id]');
+            const params = new URLSearchParams({limit: {{ history_limit }}});
+            if (firstMessage) {
+                params.set('before_id', firstMessage.dataset.id);
+            }
+            
+            fetch(`/messages/${encodeURIComponent(contact)}?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.status !== 'success') {
+                    return;
+                }
+                // 从较新的消息开始依次插到最前面，保持时间正序
+                data.messages.slice().reverse().forEach(msg => {
+                    const messageDiv = document.createElement('div');
+                    messageDiv.className = `message-item ${msg.role}`;
+                    messageDiv.dataset.id = msg.id;
+                    const roleLabel = document.createElement('strong');
+                    roleLabel.textContent = `${msg.role}:`;
+                    messageDiv.append(roleLabel, ` ${msg.content}`);
+                    messagesDiv.prepend(messageDiv);
+                });
+                if (data.messages.length < {{ history_limit }}) {
+                    const button = contactDiv.querySelector('.load-more');
+                    if (button) {
+                        button.remove();
+                    }
+                }
+            });
+        }
+
         function clearHistory(contact = null) {
             fetch('/clear_history', {
                 method: 'POST',
@@ -699,27 +1537,53 @@ if not os.path.exists(TEMPLATE_FILE):
     except Exception as e:
         logger.error(f"创建模板文件失败: {str(e)}")
 
+# 模板文件缓存，文件修改时间不变时直接返回缓存内容
+_TMPL_CACHE = {'mtime': 0, 'text': DEFAULT_TEMPLATE}
+
 def get_template():
     """获取HTML模板"""
     try:
-        if os.path.exists(TEMPLATE_FILE):
+        st = os.stat(TEMPLATE_FILE)
+        if st.st_mtime != _TMPL_CACHE['mtime']:
             with open(TEMPLATE_FILE, 'r', encoding='utf-8') as f:
-                return f.read()
+                _TMPL_CACHE['text'] = f.read()
+            _TMPL_CACHE['mtime'] = st.st_mtime
+        return _TMPL_CACHE['text']
+    except FileNotFoundError:
         return DEFAULT_TEMPLATE
     except Exception as e:
         logger.error(f"读取模板文件失败: {str(e)}")
         return DEFAULT_TEMPLATE
 
+# 已编译的模板缓存（模板源码, 编译结果）
+_compiled_template = (None, None)
+
+def get_compiled_template():
+    """获取编译后的Jinja模板，模板内容不变时复用上次的编译结果"""
+    global _compiled_template
+    source = get_template()
+    cached_source, template = _compiled_template
+    if template is None or source != cached_source:
+        # 与render_template_string使用同一个环境，保留自动转义等设置
+        template = app.jinja_env.from_string(source)
+        _compiled_template = (source, template)
+    return template
+
 # AI配置
 class Config:
-    def __init__(self):
+    def __init__(self, load=True):
         self.api_key = ""  # 移除默认key
         self.api_url = "https://api.deepseek.com"  # 只保留基础URL
         self.model_name = "deepseek-chat"
         self.system_prompt = "你是一个友好的AI助手，可以帮助用户解答问题。"
         self.temperature = 1.3
         self.max_history_length = 10
-        self.load_config()
+        # 对话上下文（不含系统提示词）的估算token上限
+        self.max_context_tokens = 4000
+        # 已加载的配置文件修改时间，文件未变化时不重复解析
+        self._config_mtime = None
+        if load:
+            self.load_config()
 
     def is_valid(self):
         """检查配置是否有效"""
@@ -732,6 +1596,10 @@ class Config:
         """获取完整的API URL"""
         return f"{self.api_url.rstrip('/')}/v1/chat/completions"
 
+    def get_models_api_url(self):
+        """获取模型列表接口的URL"""
+        return f"{self.api_url.rstrip('/')}/v1/models"
+
     def validate_temperature(self, temp):
         """验证并规范化temperature值"""
         try:
@@ -747,7 +1615,8 @@ class Config:
             "model_name": self.model_name,
             "system_prompt": self.system_prompt,
             "temperature": self.temperature,
-            "max_history_length": self.max_history_length
+            "max_history_length": self.max_history_length,
+            "max_context_tokens": self.max_context_tokens
         }
 
     def from_dict(self, data):
@@ -757,12 +1626,19 @@ class Config:
         self.system_prompt = data.get("system_prompt", self.system_prompt)
         self.temperature = self.validate_temperature(data.get("temperature", self.temperature))
         self.max_history_length = int(data.get("max_history_length", self.max_history_length))
+        self.max_context_tokens = int(data.get("max_context_tokens", self.max_context_tokens))
 
     def save_config(self):
         """保存配置到文件"""
         try:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            if orjson is not None:
+                with open(CONFIG_FILE, 'wb') as f:
+                    f.write(orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2))
+            else:
+                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+                    json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            # 内存中已是最新配置，记录修改时间避免重新解析刚写入的文件
+            self._config_mtime = os.path.getmtime(CONFIG_FILE)
             logger.info("配置已保存")
         except Exception as e:
             logger.error(f"保存配置失败: {str(e)}")
@@ -771,11 +1647,19 @@ class Config:
         """从文件加载配置"""
         try:
             if os.path.exists(CONFIG_FILE):
+                mtime = os.path.getmtime(CONFIG_FILE)
+                if mtime == self._config_mtime:
+                    return
                 logger.info(f"开始加载配置文件: {CONFIG_FILE}")
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                if orjson is not None:
+                    with open(CONFIG_FILE, 'rb') as f:
+                        data = orjson.loads(f.read())
+                else:
+                    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
                 logger.info(f"配置文件内容: {json.dumps(data, ensure_ascii=False)}")
                 self.from_dict(data)
+                self._config_mtime = mtime
                 logger.info("配置已加载")
             else:
                 logger.error(f"配置文件不存在: {CONFIG_FILE}")
@@ -784,10 +1668,68 @@ class Config:
 
 config = Config()
 
-# 存储每个联系人的消息历史和调用记录
-message_history = defaultdict(list)
-call_history = defaultdict(list)
-MAX_RETRIES = 3  # 最大重试次数
+# 低温度下模型输出基本确定，相同请求的回复可以直接复用；温度更高时每次回复本应不同，不使用缓存
+LLM_CACHE_MAX_TEMPERATURE = 0.3
+LLM_CACHE_TTL = 600
+
+# 每条消息在请求中的格式开销（角色、分隔符等），按token估算
+MESSAGE_TOKEN_OVERHEAD = 4
+# 中日韩字符，大致一个字符对应一个token
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+@functools.lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    """
+    估算文本的token数，中日韩字符按每字一个token，其余按每4个字符一个token
+    
+    Args:
+        text (str): 文本内容
+        
+    Returns:
+        int: 估算的token数
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + MESSAGE_TOKEN_OVERHEAD
+
+def trim_context_by_tokens(messages_context, max_tokens):
+    """
+    从最早的消息开始丢弃，直到对话上下文的估算token数不超过上限；最后一条消息始终保留
+    
+    Args:
+        messages_context (list): 按时间顺序排列的消息列表
+        max_tokens (int): token上限
+        
+    Returns:
+        list: 裁剪后的消息列表
+    """
+    total = 0
+    start = len(messages_context)
+    while start > 0:
+        total += estimate_tokens(messages_context[start - 1]["content"])
+        if total > max_tokens and start < len(messages_context):
+            break
+        start -= 1
+    return messages_context[start:]
+
+def _record_call(contact, success, error=None):
+    """
+    记录一次AI调用结果并通知前端
+    
+    Args:
+        contact (str): 联系人
+        success (bool): 调用是否成功
+        error (str): 失败原因
+    """
+    # 调用记录只保存在数据库中，不再额外在内存里累积
+    db.add_call_record(contact, success, error)
+    call_data = {
+        "contact": contact,
+        "time": _now_str(),
+        "success": success
+    }
+    if error is not None:
+        call_data["error"] = error
+    push_event('call_update', call_data)
 
 def get_ai_response(messages_context, contact):
     """
@@ -797,70 +1739,61 @@ def get_ai_response(messages_context, contact):
     if not config.is_valid():
         error_msg = "请先在控制台配置API密钥和相关参数"
         logger.error(error_msg)
-        call_data = {
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "success": False,
-            "error": error_msg
-        }
-        call_history[contact].append(call_data)
-        socketio.emit('call_update', {'contact': contact, **call_data})
+        _record_call(contact, False, error_msg)
         return error_msg
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            headers = {
-                "Authorization": f"Bearer {config.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # 添加system prompt
-            full_messages = [{"role": "system", "content": config.system_prompt}] + messages_context
-            
-            payload = {
-                "model": config.model_name,
-                "messages": full_messages,
-                "temperature": config.temperature
-            }
-            
-            response = requests.post(config.get_full_api_url(), json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            # 记录调用历史并通知前端
-            call_data = {
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "success": True
-            }
-            call_history[contact].append(call_data)
-            socketio.emit('call_update', {'contact': contact, **call_data})
-            
-            return response.json()["choices"][0]["message"]["content"]
-        except requests.exceptions.Timeout:
-            logger.warning(f"请求超时，尝试重试 {attempt + 1}/{MAX_RETRIES}")
-            if attempt == MAX_RETRIES - 1:
-                call_data = {
-                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "success": False,
-                    "error": "超时"
-                }
-                call_history[contact].append(call_data)
-                socketio.emit('call_update', {'contact': contact, **call_data})
-                return "抱歉，我和我的服务器联系不上了，一会儿再发一条给我试试。"
-            time.sleep(2)
-        except Exception as e:
-            logger.error(f"获取AI响应时出错: {str(e)}")
-            call_data = {
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "success": False,
-                "error": str(e)
-            }
-            call_history[contact].append(call_data)
-            socketio.emit('call_update', {'contact': contact, **call_data})
-            return "抱歉，我的服务器设置崩了，联系服务的维护者解决。"
+    try:
+        # 添加system prompt，固定放在首位且内容不变，兼容OpenAI接口的服务端可按前缀缓存
+        # 历史按估算token数截断，长消息较多时不会让每轮请求的预填充成本无限增长
+        full_messages = [{"role": "system", "content": config.system_prompt}] + \
+            trim_context_by_tokens(messages_context, config.max_context_tokens)
+        
+        # 使用共享会话复用连接，省去每轮对话的TCP/TLS握手；超时和限流等错误的重试由会话的Retry策略完成
+        # 以流式方式请求，生成过程中把片段推送给前端，完整回复生成后再发送到iMessage
+        cache_ttl = LLM_CACHE_TTL if config.temperature <= LLM_CACHE_MAX_TEMPERATURE else 0
+        content = stream_chat_completion(
+            config, full_messages, config.temperature,
+            on_delta=DeltaPusher(contact),
+            cache_ttl=cache_ttl
+        )
+        
+        # 记录调用历史并通知前端
+        _record_call(contact, True)
+        
+        return content
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        logger.warning(f"请求超时或连接失败，重试后仍未成功: {str(e)}")
+        _record_call(contact, False, "超时")
+        return "抱歉，我和我的服务器联系不上了，一会儿再发一条给我试试。"
+    except Exception as e:
+        logger.error(f"获取AI响应时出错: {str(e)}")
+        _record_call(contact, False, str(e))
+        return "抱歉，我的服务器设置崩了，联系服务的维护者解决。"
+
+# 定时提醒识别使用的关键词，各自合并为一个正则，一次扫描即可判断是否命中
+_REMINDER_KEYWORDS = ('提醒我', '定时提醒', '闹钟', '定时发送', '定时', '提醒')
+_TIME_KEYWORDS = ('分钟后', '小时后', '天后', '今天', '明天', '后天', '点', '点钟', '：', ':', '以后', '之后', '过后', '个小时', '个分钟')
+_REMINDER_KEYWORDS_RE = re.compile('|'.join(map(re.escape, _REMINDER_KEYWORDS)))
+_TIME_KEYWORDS_RE = re.compile('|'.join(map(re.escape, _TIME_KEYWORDS)))
+
+# 大模型提取失败时从消息中截取提醒内容
+_REMINDER_CONTENT_RE = re.compile(r'提醒我(.+?)(?:在|到|于|到了)')
+
+# 提醒内容中的天气/新闻任务识别，各为一个正则，一次扫描同时判断是否命中并取出城市/类别
+# 命中条件即内容中出现对应关键词，城市和类别为可选分组
+_WEATHER_TASK_RE = re.compile(r'(?:(?:查询|查看|获取|告诉我).*?)?(?P<city>[\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县)?.*?(?:天气|气温|温度)')
+_NEWS_TASK_RE = re.compile(r'(?P<category>[\u4e00-\u9fa5]{2,})?(?:新闻|资讯|热点)')
+
+# 常见城市和新闻类别，按顺序取第一个出现在内容中的
+_COMMON_CITIES = ('北京', '上海', '广州', '深圳', '杭州', '南京', '成都', '重庆', '武汉', '西安')
+_COMMON_NEWS_CATEGORIES = ('科技', '财经', '体育', '娱乐', '国际', '国内', '社会', '军事')
 
 def process_message(message):
     """
     处理单条消息
     """
+    # 已收到但尚未随回复保存的用户消息，处理出错时单独保存
+    unsaved = None
     try:
         if not message['is_from_me'] and message['contact']:
             contact = message['contact']
@@ -868,11 +1801,11 @@ def process_message(message):
             
             logger.info(f"收到新消息: {user_message} 来自: {contact}")
             
-            # 保存用户消息
-            db.add_message(contact, "user", user_message)
+            # 用户消息与回复在得到回复后通过add_turn一起保存
+            unsaved = (contact, user_message)
             
             # 通知前端新消息
-            socketio.emit('new_message', {
+            push_event('new_message', {
                 'contact': contact,
                 'role': 'user',
                 'content': user_message
@@ -880,16 +1813,17 @@ def process_message(message):
             
             # 检查是否是定时任务请求
             is_reminder_request = False
-            reminder_keywords = ['提醒我', '定时提醒', '闹钟', '定时发送', '定时', '提醒']
-            time_keywords = ['分钟后', '小时后', '天后', '今天', '明天', '后天', '点', '点钟', '：', ':', '以后', '之后', '过后', '个小时', '个分钟']
             
             # 检查是否包含提醒关键词和时间关键词
-            has_reminder_keyword = any(keyword in user_message for keyword in reminder_keywords)
-            has_time_keyword = any(keyword in user_message for keyword in time_keywords)
+            has_reminder_keyword = _REMINDER_KEYWORDS_RE.search(user_message) is not None
+            has_time_keyword = _TIME_KEYWORDS_RE.search(user_message) is not None
             
-            # 添加更详细的日志
-            logger.info(f"[DEBUG] 提醒关键词检测: {has_reminder_keyword}, 匹配关键词: {[kw for kw in reminder_keywords if kw in user_message]}")
-            logger.info(f"[DEBUG] 时间关键词检测: {has_time_keyword}, 匹配关键词: {[kw for kw in time_keywords if kw in user_message]}")
+            # 详细的关键词命中情况只在调试级别输出，未启用时跳过逐个关键词的匹配和格式化
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("提醒关键词检测: %s, 匹配关键词: %s", has_reminder_keyword,
+                             [kw for kw in _REMINDER_KEYWORDS if kw in user_message])
+                logger.debug("时间关键词检测: %s, 匹配关键词: %s", has_time_keyword,
+                             [kw for kw in _TIME_KEYWORDS if kw in user_message])
             
             if has_reminder_keyword and has_time_keyword:
                 is_reminder_request = True
@@ -909,8 +1843,6 @@ def process_message(message):
                     context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_messages])
                     logger.info(f"[DEBUG] 尝试使用大模型解析时间，上下文长度: {len(context)}")
                     
-                    # 导入时间解析模块
-                    from agents.time_parser import parse_time_with_llm
                     scheduled_time = parse_time_with_llm(user_message, context, config)
                     
                     # 记录使用了大模型解析
@@ -921,15 +1853,14 @@ def process_message(message):
             
             # 如果成功解析到时间，创建定时任务
             if scheduled_time and scheduled_time > datetime.now():
-                # 提取提醒内容
-                # 使用大模型提取提醒内容
-                reminder_content = extract_reminder_content_with_llm(user_message, scheduled_time)
+                # 使用大模型提取提醒内容，同时得到大模型识别的任务
+                reminder = extract_reminder_with_llm(user_message, scheduled_time)
+                reminder_content = reminder["content"] if reminder else None
                 logger.info(f"[DEBUG] 提取的提醒内容: {reminder_content}")
                 
                 if not reminder_content:
                     # 如果大模型提取失败，回退到正则表达式
-                    content_pattern = r'提醒我(.+?)(?:在|到|于|到了)'
-                    content_match = re.search(content_pattern, user_message)
+                    content_match = _REMINDER_CONTENT_RE.search(user_message)
                     reminder_content = content_match.group(1).strip() if content_match else user_message
                     logger.info(f"[DEBUG] 使用正则表达式提取的提醒内容: {reminder_content}")
                 
@@ -939,251 +1870,316 @@ def process_message(message):
                 
                 logger.info(f"[DEBUG] 分析提醒内容是否包含任务: {reminder_content}")
                 
-                # 检查是否是天气查询
-                weather_pattern = r'(查询|查看|获取|告诉我).*?([\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县).*?(天气|气温|温度)'
-                weather_match = re.search(weather_pattern, reminder_content)
-                
-                # 更宽松的天气查询模式
-                simple_weather_pattern = r'([\u4e00-\u9fa5]{2,}市?|[\u4e00-\u9fa5]{2,}县).*?(天气|气温|温度)'
-                simple_weather_match = re.search(simple_weather_pattern, reminder_content)
-                
-                # 直接检查是否包含"天气"和城市名
-                has_weather = '天气' in reminder_content or '气温' in reminder_content or '温度' in reminder_content
-                
-                if weather_match or simple_weather_match or has_weather:
+                # 检查是否是天气查询，常见城市优先，其次取正则匹配到的城市，都没有时默认为北京
+                weather_match = _WEATHER_TASK_RE.search(reminder_content)
+                if weather_match:
                     task_type = "weather"
-                    # 提取城市
-                    city = None
-                    
-                    # 尝试从正则表达式匹配中提取城市
-                    if weather_match:
-                        city = weather_match.group(2)
-                    elif simple_weather_match:
-                        city = simple_weather_match.group(1)
-                    
-                    # 检查常见城市名称
-                    common_cities = ['北京', '上海', '广州', '深圳', '杭州', '南京', '成都', '重庆', '武汉', '西安']
-                    for common_city in common_cities:
-                        if common_city in reminder_content:
-                            city = common_city
-                            break
-                    
-                    # 如果仍然没有找到城市，默认为北京
-                    if not city:
-                        city = "北京"
-                        
-                    task_params = json.dumps({"city": city})
+                    city = next((c for c in _COMMON_CITIES if c in reminder_content), None) \
+                        or weather_match.group('city') or "北京"
+                    task_params = json_dumps({"city": city})
                     logger.info(f"[DEBUG] 检测到天气查询任务，城市: {city}")
                 
-                # 检查是否是新闻查询
-                news_pattern = r'(查询|查看|获取|告诉我).*?(新闻|资讯|热点)'
-                news_match = re.search(news_pattern, reminder_content)
-                
-                # 更宽松的新闻查询模式
-                simple_news_pattern = r'([\u4e00-\u9fa5]{2,})?(新闻|资讯|热点)'
-                simple_news_match = re.search(simple_news_pattern, reminder_content)
-                
-                if news_match or simple_news_match or '新闻' in reminder_content:
+                # 检查是否是新闻查询，常见类别优先，其次取正则匹配到的类别，都没有时为综合
+                news_match = _NEWS_TASK_RE.search(reminder_content)
+                if news_match:
                     task_type = "news"
-                    # 提取类别
-                    category = "综合"
-                    
-                    # 尝试从正则表达式匹配中提取类别
-                    if news_match and len(news_match.groups()) > 1:
-                        category_match = re.search(r'([\u4e00-\u9fa5]{2,})(?:新闻|资讯|热点)', reminder_content)
-                        if category_match:
-                            category = category_match.group(1)
-                    elif simple_news_match and simple_news_match.group(1):
-                        category = simple_news_match.group(1)
-                    
-                    # 检查常见新闻类别
-                    common_categories = ['科技', '财经', '体育', '娱乐', '国际', '国内', '社会', '军事']
-                    for common_category in common_categories:
-                        if common_category in reminder_content:
-                            category = common_category
-                            break
-                    
-                    task_params = json.dumps({"category": category})
+                    category = next((c for c in _COMMON_NEWS_CATEGORIES if c in reminder_content), None) \
+                        or news_match.group('category') or "综合"
+                    task_params = json_dumps({"category": category})
                     logger.info(f"[DEBUG] 检测到新闻查询任务，类别: {category}")
                 
-                # 如果无法通过规则识别，尝试使用大模型识别
-                if not task_type and len(reminder_content) > 5:  # 内容足够长，可能包含任务
+                # 如果无法通过规则识别，使用提取提醒内容时大模型一并识别的任务
+                if not task_type and reminder and reminder["task_type"]:
+                    task_type = reminder["task_type"]
+                    task_params = json_dumps(reminder["task_params"])
+                    logger.info(f"[DEBUG] 使用大模型检测到任务，类型: {task_type}, 参数: {task_params}")
+                
+                # 大模型提取失败、内容由正则截取时，单独识别任务
+                elif not task_type and not reminder and len(reminder_content) > 5:  # 内容足够长，可能包含任务
                     try:
-                        from agents.agent_base import detect_task_with_llm
                         task_info = detect_task_with_llm(reminder_content, contact, config)
                         if task_info:
                             task_type = task_info.get("task_type")
                             params = task_info.get("params", {})
                             if task_type:
-                                task_params = json.dumps(params)
+                                task_params = json_dumps(params)
                                 logger.info(f"[DEBUG] 使用大模型检测到任务，类型: {task_type}, 参数: {params}")
                     except Exception as e:
                         logger.error(f"使用大模型识别任务时出错: {str(e)}")
                 
-                # 创建定时任务
-                task_id, scheduled_time = create_scheduled_task(
-                    contact, 
-                    reminder_content, 
-                    scheduled_time,
-                    task_type=task_type,
-                    task_params=task_params
-                )
-                
-                logger.info(f"[DEBUG] 成功创建定时任务: ID={task_id}, 时间={scheduled_time}, 内容={reminder_content}")
-                
-                # 回复用户
-                formatted_time = scheduled_time.strftime("%Y年%m月%d日 %H:%M")
-                ai_response = f"好的，我会在{formatted_time}提醒您：{reminder_content}"
+                # 创建定时任务，任务数已达上限时直接告知用户
+                try:
+                    task_id, scheduled_time = create_scheduled_task(
+                        contact, 
+                        reminder_content, 
+                        scheduled_time,
+                        task_type=task_type,
+                        task_params=task_params
+                    )
+                    
+                    logger.info(f"[DEBUG] 成功创建定时任务: ID={task_id}, 时间={scheduled_time}, 内容={reminder_content}")
+                    
+                    # 回复用户
+                    formatted_time = scheduled_time.strftime("%Y年%m月%d日 %H:%M")
+                    ai_response = f"好的，我会在{formatted_time}提醒您：{reminder_content}"
+                except RuntimeError as e:
+                    task_id = None
+                    ai_response = f"抱歉，{str(e)}"
                 
-                # 保存AI响应
-                db.add_message(contact, "assistant", ai_response)
+                # 保存本轮对话
+                db.add_turn(contact, user_message, ai_response)
+                unsaved = None
                 
                 # 通知前端AI响应
-                socketio.emit('new_message', {
+                push_event('new_message', {
                     'contact': contact,
                     'role': 'assistant',
                     'content': ai_response
                 })
                 
                 # 发送回复
-                send_imessage(contact, ai_response)
+                queue_imessage(contact, ai_response)
                 logger.info(f"已设置定时任务 {task_id} 并回复消息: {ai_response} 给: {contact}")
             else:
                 # 尝试检测并执行自动任务
                 agent_response = detect_and_execute_agent_task(user_message, contact)
                 
                 if agent_response:
-                    # 保存AI响应
-                    db.add_message(contact, "assistant", agent_response)
+                    # 保存本轮对话
+                    db.add_turn(contact, user_message, agent_response)
+                    unsaved = None
                     
                     # 通知前端AI响应
-                    socketio.emit('new_message', {
+                    push_event('new_message', {
                         'contact': contact,
                         'role': 'assistant',
                         'content': agent_response
                     })
                     
                     # 发送回复
-                    send_imessage(contact, agent_response)
+                    queue_imessage(contact, agent_response)
                     logger.info(f"已执行自动任务并回复消息: {agent_response} 给: {contact}")
                 else:
-                    # 获取AI响应
-                    ai_response = get_ai_response(db.get_messages(contact, config.max_history_length), contact)
+                    # 获取AI响应，当前消息尚未入库，拼在历史记录之后
+                    history = db.get_messages(contact, config.max_history_length - 1) if config.max_history_length > 1 else []
+                    ai_response = get_ai_response(history + [{"role": "user", "content": user_message}], contact)
                     
-                    # 保存AI响应
-                    db.add_message(contact, "assistant", ai_response)
+                    # 保存本轮对话
+                    db.add_turn(contact, user_message, ai_response)
+                    unsaved = None
                     
                     # 通知前端AI响应
-                    socketio.emit('new_message', {
+                    push_event('new_message', {
                         'contact': contact,
                         'role': 'assistant',
                         'content': ai_response
                     })
                     
                     # 发送回复
-                    send_imessage(contact, ai_response)
+                    queue_imessage(contact, ai_response)
                     logger.info(f"已回复消息: {ai_response} 给: {contact}")
             
     except Exception as e:
         logger.error(f"处理消息时出错: {str(e)}")
+        # 前端已显示该消息，未能得到回复时也保存用户消息，避免刷新后消失
+        if unsaved:
+            db.add_message(unsaved[0], 'user', unsaved[1])
+
+# 提醒内容提取结果缓存，按模型和规范化后的消息索引；提取结果与提醒时间无关，时间不计入键
+_REMINDER_CACHE = TTLCache(maxsize=1024, ttl=LLM_CACHE_TTL)
+
+# 提醒到期时可以自动执行的任务类型
+REMINDER_TASK_TYPES = frozenset({'weather', 'news', 'search', 'calculate', 'translate'})
+
+# 提取提醒内容的同时识别到期时需要执行的任务，一次请求完成，不再单独调用任务识别
+# 系统提示词保持不变，提醒时间放在用户消息中，使每次请求的前缀相同，可命中服务端的提示缓存
+_REMINDER_EXTRACT_PROMPT = """你是一个专门提取提醒内容的AI助手。
+用户的消息中包含了一个提醒请求和时间信息，用户消息中会给出已经确定的提醒时间。
+请从用户消息中提取出用户想要被提醒的具体内容或事项。
+如果消息中包含天气查询、新闻查询等特定任务，请确保完整提取这些信息。
+例如，如果用户说"一分钟后告诉我上海天气"，应提取"上海天气"而不仅仅是"天气"。
+如果用户说"一个小时以后提醒我取快递，取件码是123456"，应提取"取快递，取件码是123456"。
+
+同时判断提醒到期时是否需要执行以下任务之一，并给出对应参数：
+- weather（天气查询）: {"city": "城市名"}
+- news（新闻获取）: {"category": "新闻类别"}
+- search（信息搜索）: {"query": "搜索查询"}
+- calculate（计算或转换）: {"expression": "计算表达式"}
+- translate（翻译）: {"text": "要翻译的文本", "target_language": "目标语言"}
+
+只返回一个JSON对象，不要包含任何其他解释或格式：
+{"content": "提醒内容", "task_type": "任务类型", "task_params": {}}
+如果无法确定具体内容，content返回null；不需要执行任务时task_type返回null。"""
 
 # 使用大模型提取提醒内容
-def extract_reminder_content_with_llm(message, scheduled_time):
+def extract_reminder_with_llm(message, scheduled_time):
     """
-    使用大模型从消息中提取提醒内容
+    使用大模型从消息中提取提醒内容，并识别提醒到期时需要执行的任务
     
     Args:
         message: 用户消息
         scheduled_time: 已解析的时间
         
     Returns:
-        提取的提醒内容或None
+        dict: 包含content、task_type和task_params的字典，提取失败时返回None
     """
     try:
+        cache_key = (config.model_name, normalize_key(message))
+        reminder = _REMINDER_CACHE.get(cache_key)
+        if reminder is not None:
+            logger.info(f"命中提醒内容缓存: {reminder}")
+            return reminder
+        
         # 格式化时间为易读格式
         formatted_time = scheduled_time.strftime("%Y年%m月%d日 %H:%M")
         
-        # 构建提示
-        system_prompt = """你是一个专门提取提醒内容的AI助手。
-用户的消息中包含了一个提醒请求和时间信息。
-我已经确定提醒时间是: {formatted_time}
-请从用户消息中提取出用户想要被提醒的具体内容或事项。
-如果消息中包含天气查询、新闻查询等特定任务，请确保完整提取这些信息。
-例如，如果用户说"一分钟后告诉我上海天气"，应提取"上海天气"而不仅仅是"天气"。
-如果用户说"一个小时以后提醒我取快递，取件码是123456"，应提取"取快递，取件码是123456"。
-只返回提取出的内容，不要包含任何其他解释或格式。
-如果无法确定具体内容，请返回null。"""
-        
-        user_prompt = f"从以下消息中提取提醒内容: {message}"
+        user_prompt = f"提醒时间: {formatted_time}\n从以下消息中提取提醒内容: {message}"
         
         # 添加日志记录
         logger.info(f"[DEBUG] 尝试使用LLM提取提醒内容: {message}")
         
-        # 调用AI模型
-        headers = {
-            "Authorization": f"Bearer {config.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": config.model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt.format(formatted_time=formatted_time)},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.2
-        }
-        
-        response = requests.post(config.get_full_api_url(), json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        # 解析响应
-        content = response.json()["choices"][0]["message"]["content"].strip()
+        # 调用AI模型，结果由上面的规范化缓存复用
+        messages = [
+            {"role": "system", "content": _REMINDER_EXTRACT_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+        ai_response = chat_completion(config, messages, 0.2)
+        result = json_loads(extract_json(ai_response))
         
         # 如果返回null或空字符串，则返回None
-        if content.lower() == "null" or not content:
+        content = result.get("content")
+        if not isinstance(content, str) or not content.strip() or content.strip().lower() == "null":
             logger.warning(f"[DEBUG] LLM提取提醒内容返回空或null")
             return None
+        
+        task_type = result.get("task_type")
+        task_params = result.get("task_params")
+        if task_type not in REMINDER_TASK_TYPES:
+            task_type = None
+        reminder = {
+            "content": content.strip(),
+            "task_type": task_type,
+            "task_params": task_params if task_type and isinstance(task_params, dict) else {}
+        }
             
-        logger.info(f"成功提取提醒内容: {content}")
-        return content
+        logger.info(f"成功提取提醒内容: {reminder}")
+        _REMINDER_CACHE.set(cache_key, reminder)
+        return reminder
         
     except Exception as e:
         logger.error(f"使用LLM提取提醒内容时出错: {str(e)}")
         return None
 
+# 待发送的回复，由单独的发送线程按入队顺序逐条发送，消息处理线程无需等待AppleScript执行完成
+_outbox = queue.Queue()
+
+def _sender_loop():
+    """发送线程主循环"""
+    while True:
+        contact, text = _outbox.get()
+        try:
+            # send_imessage失败时返回False而不是抛出异常
+            if not send_imessage(contact, text):
+                logger.error(f"发送消息给 {contact} 失败")
+        except Exception as e:
+            logger.error(f"发送消息给 {contact} 时出错: {str(e)}")
+        finally:
+            _outbox.task_done()
+
+def queue_imessage(contact, text):
+    """
+    把回复放入发送队列后立即返回
+    
+    Args:
+        contact (str): 联系人
+        text (str): 消息内容
+    """
+    _outbox.put((contact, text))
+
+threading.Thread(target=_sender_loop, name="iMessageSender", daemon=True).start()
+
+# 消息处理线程数；每个联系人固定分配到其中一个单线程执行器，不同联系人的消息并发处理，
+# 同一联系人的消息按到达顺序依次处理
+MESSAGE_WORKERS = 8
+_message_workers = [
+    concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"MessageWorker{i}")
+    for i in range(MESSAGE_WORKERS)
+]
+
+def _process_messages(messages):
+    """依次处理同一联系人的消息，单条消息出错不影响后续消息"""
+    for message in messages:
+        process_message(message)
+
 def on_new_messages(messages):
     """
     处理新消息的回调函数
+    
+    按联系人分发到消息处理线程后立即返回，等待AI响应期间不阻塞消息监控线程
     """
+    by_contact = defaultdict(list)
     for message in messages:
-        process_message(message)
+        by_contact[message['contact']].append(message)
+    for contact, contact_messages in by_contact.items():
+        worker = _message_workers[hash(contact) % MESSAGE_WORKERS]
+        worker.submit(_process_messages, contact_messages)
+
+# 控制台页面渲染结果缓存，键中包含配置和数据版本，数据变化后自动失效
+DASHBOARD_CACHE_TTL = 10
+_dashboard_cache = TTLCache(maxsize=8, ttl=DASHBOARD_CACHE_TTL)
+
+# 没有任何对话时的控制台页面（缓存键, 页面），只随模板和配置变化
+_empty_dashboard = (None, None)
 
 @app.route('/')
 def index():
     """
     主页（控制台）
     """
-    template = get_template()
+    cache_key = (tuple(config.to_dict().items()), db.version)
+    html = _dashboard_cache.get(cache_key)
+    if html is None:
+        html = render_index()
+        _dashboard_cache.set(cache_key, html)
+    return html
+
+def render_index():
+    """
+    渲染控制台页面
+    """
+    global _empty_dashboard
+    template = get_compiled_template()
     contacts_data = db.get_all_contacts_with_stats()
     
-    # 构建模板数据
-    message_history = {}
+    # 新安装或已清空历史时页面内容固定，直接复用预先渲染的结果
+    if not contacts_data:
+        empty_key = (template, tuple(config.to_dict().items()))
+        cached_key, html = _empty_dashboard
+        if html is None or cached_key != empty_key:
+            html = template.render(config=config,
+                                   message_history={},
+                                   call_history={},
+                                   history_limit=DASHBOARD_HISTORY_LIMIT)
+            _empty_dashboard = (empty_key, html)
+        return html
+    
+    # 构建模板数据，所有联系人的消息一次查出，不再逐个联系人查询
+    message_history = db.get_all_messages()
     call_history = defaultdict(list)
     
-    for contact, msg_count, last_call, success, error in contacts_data:
-        message_history[contact] = db.get_messages(contact)
+    for contact, msg_count, last_call, success, error, call_count in contacts_data:
         if last_call:
             call_history[contact].append({
                 "time": last_call,
                 "success": success,
-                "error": error
+                "error": error,
+                "count": call_count
             })
     
-    return render_template_string(template, 
-                                config=config,
-                                message_history=message_history,
-                                call_history=call_history)
+    return template.render(config=config,
+                           message_history=message_history,
+                           call_history=call_history,
+                           history_limit=DASHBOARD_HISTORY_LIMIT)
 
 @app.route('/config', methods=['POST'])
 def update_config():
@@ -1210,6 +2206,19 @@ def clear_history():
     except Exception as e:
         return jsonify({"status": "error", "message": f"清除历史记录失败: {str(e)}"})
 
+@app.route('/messages/<contact>', methods=['GET'])
+def get_contact_messages(contact):
+    """
+    分页获取联系人更早的消息
+    """
+    try:
+        before_id = request.args.get('before_id', type=int)
+        limit = min(request.args.get('limit', DASHBOARD_HISTORY_LIMIT, type=int), 500)
+        messages = db.get_messages_before(contact, before_id, limit)
+        return jsonify({"status": "success", "messages": messages})
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"获取消息失败: {str(e)}"})
+
 @app.route('/test_ai', methods=['POST'])
 def test_ai():
     """
@@ -1217,8 +2226,9 @@ def test_ai():
     """
     try:
         data = request.json
-        # 使用配置中的值，但允许请求中的值覆盖
-        temp_config = Config()
+        # 使用配置中的值，但允许请求中的值覆盖；直接复制内存中的配置，不重新读取配置文件
+        temp_config = Config(load=False)
+        temp_config.from_dict(config.to_dict())
         temp_config.from_dict(data)
         
         # 使用简单的测试提示
@@ -1230,15 +2240,30 @@ def test_ai():
                 "message": "API配置无效，请检查API密钥、URL和模型名称"
             })
         
-        # 构建测试消息上下文
-        test_context = [{"role": "user", "content": prompt}]
-        
         # 构建请求
         headers = {
             "Authorization": f"Bearer {temp_config.api_key}",
             "Content-Type": "application/json"
         }
         
+        # 先请求模型列表接口，一次往返即可验证地址、密钥和网络，不消耗token；
+        # 请求中指定full_test时才发送完整的对话请求
+        if not data.get('full_test'):
+            models_response = run_blocking(SESSION.get, temp_config.get_models_api_url(), headers=headers, timeout=(3, 5))
+            if models_response.ok:
+                return jsonify({
+                    "status": "success",
+                    "message": "连接测试成功！",
+                    "response": "模型列表接口响应正常（未发送对话请求）"
+                })
+            if models_response.status_code in (401, 403):
+                models_response.raise_for_status()
+            # 服务商未提供模型列表接口时，退回到完整的对话请求
+            logger.info(f"模型列表接口返回 {models_response.status_code}，改用对话请求测试")
+        
+        # 构建测试消息上下文
+        test_context = [{"role": "user", "content": prompt}]
+        
         payload = {
             "model": temp_config.model_name,
             "messages": [{"role": "system", "content": temp_config.system_prompt}] + test_context,
@@ -1246,11 +2271,11 @@ def test_ai():
         }
         
         # 发送请求
-        response = requests.post(temp_config.get_full_api_url(), json=payload, headers=headers, timeout=15)
+        response = run_blocking(SESSION.post, temp_config.get_full_api_url(), json=payload, headers=headers, timeout=(3, 15))
         response.raise_for_status()
         
         # 解析响应
-        ai_response = response.json()["choices"][0]["message"]["content"]
+        ai_response = json_loads(response.content)["choices"][0]["message"]["content"]
         
         return jsonify({
             "status": "success",
@@ -1292,6 +2317,12 @@ def get_tasks():
                 recurring_value = None
                 next_run_time = None
             
+            # 循环任务的下一次执行时间由调度器维护
+            if is_recurring and job_id:
+                job = scheduler.get_job(job_id)
+                if job and job.next_run_time:
+                    next_run_time = job.next_run_time.strftime("%Y-%m-%d %H:%M:%S")
+            
             # 确定显示的执行时间
             display_time = next_run_time if is_recurring and next_run_time else scheduled_time
             
@@ -1327,12 +2358,7 @@ def delete_task(task_id):
     """
     try:
         # 获取任务信息
-        tasks = db.get_scheduled_tasks()
-        task = None
-        for t in tasks:
-            if t[0] == task_id:
-                task = t
-                break
+        task = db.get_task_by_id(task_id)
         
         if not task:
             return jsonify({
@@ -1395,6 +2421,8 @@ def create_task():
             })
         
         try:
+            # 页面提交的时间格式不固定，用dateutil解析；只在创建任务时才加载
+            from dateutil import parser
             scheduled_time = parser.parse(scheduled_time_str)
         except Exception:
             return jsonify({
@@ -1441,11 +2469,11 @@ def create_task():
         
         # 如果是天气任务，但没有提供参数，则添加默认参数
         if task_type == 'weather' and not task_params:
-            task_params = json.dumps({"city": "北京"})
+            task_params = json_dumps({"city": "北京"})
         
         # 如果是新闻任务，但没有提供参数，则添加默认参数
         if task_type == 'news' and not task_params:
-            task_params = json.dumps({"category": "科技"})
+            task_params = json_dumps({"category": "科技"})
         
         # 创建定时任务
         task_id, scheduled_time = create_scheduled_task(
@@ -1475,16 +2503,27 @@ def create_task():
             "message": f"创建任务失败: {str(e)}"
         })
 
+# iMessage读取器，由start_message_monitor启动、shutdown_service停止
+reader = iMessageReader()
+
 def start_message_monitor():
     """
-    启动消息监控
+    启动消息监控，读取线程和文件系统观察者在后台运行，启动后立即返回
     """
-    reader = iMessageReader()
-    if reader.check_db_access():
+    if reader.start(callback=on_new_messages, as_dict=False):
         logger.info("开始监控 iMessage...")
-        reader.monitor_messages(callback=on_new_messages)
-    else:
-        logger.error("无法访问 iMessage 数据库，请确保已授予权限")
+
+# 消息中的时间表达式，相对时间、中文相对时间、今天/明天/后天、具体日期合并为一个正则，一次扫描即可定位
+_TIME_ALL_RE = re.compile(
+    r'(?P<rel>\d+)\s*(?P<unit>分钟|小时|天)后'
+    r'|(?P<cn>[一二两三四五六七八九十])\s*(?P<cnunit>分钟|小时|天)后'
+    r'|(?P<day>今天|明天|后天)'
+    r'|(?P<month>\d+)月(?P<date>\d+)日'
+)
+_CLOCK_TIME_RE = re.compile(r'(上午|中午|下午|晚上)?\s*(\d+)(?:点|时)(?:(\d+)分?)?')
+_CHINESE_NUM_MAP = {'一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+_TIME_UNIT_MAP = {'分钟': 'minutes', '小时': 'hours', '天': 'days'}
+_DAY_OFFSET_MAP = {'今天': 0, '明天': 1, '后天': 2}
 
 # 时间解析和定时任务创建
 def parse_time_from_message(message):
@@ -1497,91 +2536,67 @@ def parse_time_from_message(message):
     """
     now = datetime.now()
     
-    # 相对时间模式
-    relative_pattern = r'(\d+)\s*(分钟|小时|天)后'
-    relative_match = re.search(relative_pattern, message)
-    if relative_match:
-        amount = int(relative_match.group(1))
-        unit = relative_match.group(2)
-        if unit == '分钟':
-            return now + timedelta(minutes=amount)
-        elif unit == '小时':
-            return now + timedelta(hours=amount)
-        elif unit == '天':
-            return now + timedelta(days=amount)
-    
-    # 更宽松的相对时间模式（如"一分钟后"、"两小时后"等）
-    chinese_num_map = {'一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
-    chinese_relative_pattern = r'([一二两三四五六七八九十])\s*(分钟|小时|天)后'
-    chinese_relative_match = re.search(chinese_relative_pattern, message)
-    if chinese_relative_match:
-        amount = chinese_num_map.get(chinese_relative_match.group(1), 1)
-        unit = chinese_relative_match.group(2)
-        if unit == '分钟':
-            return now + timedelta(minutes=amount)
-        elif unit == '小时':
-            return now + timedelta(hours=amount)
-        elif unit == '天':
-            return now + timedelta(days=amount)
-    
-    # 今天/明天/后天模式
-    day_pattern = r'(今天|明天|后天)'
-    day_match = re.search(day_pattern, message)
-    if day_match:
-        day_offset = {'今天': 0, '明天': 1, '后天': 2}[day_match.group(1)]
-        target_date = now + timedelta(days=day_offset)
-        
-        # 提取时间
-        time_pattern = r'(上午|中午|下午|晚上)?\s*(\d+)(?:点|时)(?:(\d+)分?)?'
-        time_match = re.search(time_pattern, message)
-        if time_match:
-            period = time_match.group(1) or ''
-            hour = int(time_match.group(2))
-            minute = int(time_match.group(3) or 0)
-            
-            # 调整小时
-            if period == '下午' or period == '晚上':
-                if hour < 12:
-                    hour += 12
-            elif period == '上午' and hour == 12:
-                hour = 0
-                
-            return target_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    match = _TIME_ALL_RE.search(message)
+    if not match:
+        return None
+    
+    # 相对时间（如"5分钟后"、"两小时后"）
+    if match.group('rel'):
+        return now + timedelta(**{_TIME_UNIT_MAP[match.group('unit')]: int(match.group('rel'))})
+    if match.group('cn'):
+        return now + timedelta(**{_TIME_UNIT_MAP[match.group('cnunit')]: _CHINESE_NUM_MAP.get(match.group('cn'), 1)})
+    
+    # 今天/明天/后天和具体日期都需要再提取时间
+    time_match = _CLOCK_TIME_RE.search(message)
+    if not time_match:
+        return None
+    
+    period = time_match.group(1) or ''
+    hour = int(time_match.group(2))
+    minute = int(time_match.group(3) or 0)
+    
+    # 调整小时
+    if period == '下午' or period == '晚上':
+        if hour < 12:
+            hour += 12
+    elif period == '上午' and hour == 12:
+        hour = 0
+    
+    if match.group('day'):
+        target_date = now + timedelta(days=_DAY_OFFSET_MAP[match.group('day')])
+        return target_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
     
     # 具体日期模式
-    date_pattern = r'(\d+)月(\d+)日'
-    date_match = re.search(date_pattern, message)
-    if date_match:
-        month = int(date_match.group(1))
-        day = int(date_match.group(2))
-        year = now.year
-        
-        # 如果指定的月份已经过去，假设是明年
-        if month < now.month or (month == now.month and day < now.day):
-            year += 1
-            
-        # 提取时间
-        time_pattern = r'(上午|中午|下午|晚上)?\s*(\d+)(?:点|时)(?:(\d+)分?)?'
-        time_match = re.search(time_pattern, message)
-        if time_match:
-            period = time_match.group(1) or ''
-            hour = int(time_match.group(2))
-            minute = int(time_match.group(3) or 0)
-            
-            # 调整小时
-            if period == '下午' or period == '晚上':
-                if hour < 12:
-                    hour += 12
-            elif period == '上午' and hour == 12:
-                hour = 0
-                
-            try:
-                return datetime(year, month, day, hour, minute, 0)
-            except ValueError:
-                # 处理无效日期
-                return None
+    month = int(match.group('month'))
+    day = int(match.group('date'))
+    year = now.year
+    
+    # 如果指定的月份已经过去，假设是明年
+    if month < now.month or (month == now.month and day < now.day):
+        year += 1
     
-    return None
+    try:
+        return datetime(year, month, day, hour, minute, 0)
+    except ValueError:
+        # 处理无效日期
+        return None
+
+# 调度器中最多保留的待执行任务数，超出后拒绝创建新任务，避免任务无限增长拖慢调度
+MAX_PENDING_JOBS = 10000
+
+def check_pending_jobs(count=1):
+    """
+    检查调度器是否还能容纳新任务
+    
+    Args:
+        count (int): 准备新增的任务数
+    
+    Raises:
+        RuntimeError: 待执行任务数已达上限
+    """
+    if len(scheduler.get_jobs()) + count > MAX_PENDING_JOBS:
+        logger.warning(f"待执行的定时任务已达上限 {MAX_PENDING_JOBS}，拒绝创建新任务")
+        raise RuntimeError("定时任务数量已达上限，请先删除部分任务")
 
 def create_scheduled_task(contact, message, scheduled_time, reminder_message=None, is_recurring=False, recurring_type=None, recurring_value=None, task_type=None, task_params=None):
     """
@@ -1600,7 +2615,12 @@ def create_scheduled_task(contact, message, scheduled_time, reminder_message=Non
     
     Returns:
         (task_id, scheduled_time): 任务ID和计划执行时间
+    
+    Raises:
+        RuntimeError: 待执行任务数已达上限
     """
+    check_pending_jobs()
+    
     if not reminder_message:
         reminder_message = "这是您之前设置的提醒消息：" + message
     
@@ -1609,7 +2629,7 @@ def create_scheduled_task(contact, message, scheduled_time, reminder_message=Non
     
     # 如果有任务类型，记录日志
     if task_type:
-        logger.info(f"创建自动化任务: {task_type}, 参数: {task_params}")
+        logger.info("创建自动化任务: %s, 参数: %s", task_type, task_params)
     
     # 保存到数据库
     task_id = db.add_scheduled_task(
@@ -1624,24 +2644,66 @@ def create_scheduled_task(contact, message, scheduled_time, reminder_message=Non
         task_params=task_params
     )
     
-    # 添加到调度器
-    job = scheduler.add_job(
-        execute_scheduled_task,
-        'date',
-        run_date=scheduled_time,
-        args=[task_id, contact, reminder_message],
-        id=f"task_{task_id}" if not is_recurring else f"task_{task_id}_{scheduled_time.strftime('%Y%m%d%H%M%S')}"
-    )
-    
-    # 更新任务的job_id
-    db.update_task_job_id(task_id, job.id)
+    # 添加到调度器，job_id已在插入任务时写入
+    schedule_task_job(task_id, contact, reminder_message, scheduled_time, is_recurring, recurring_type, recurring_value)
     
-    logger.info(f"已创建{'循环' if is_recurring else '一次性'}任务 {task_id}，执行时间: {scheduled_time}")
+    logger.info("已创建%s任务 %s，执行时间: %s", '循环' if is_recurring else '一次性', task_id, scheduled_time)
     if is_recurring:
-        logger.info(f"循环类型: {recurring_type}，值: {recurring_value}")
+        logger.info("循环类型: %s，值: %s", recurring_type, recurring_value)
     
     return task_id, scheduled_time
 
+def create_scheduled_tasks_bulk(specs):
+    """
+    批量创建定时任务，所有任务在一个事务中写入数据库，并在调度器暂停期间一次性加入
+    
+    Args:
+        specs (list): 任务参数字典列表，键与create_scheduled_task的参数相同
+    
+    Returns:
+        list: 与specs顺序一致的(task_id, scheduled_time)元组列表
+    
+    Raises:
+        RuntimeError: 待执行任务数已达上限
+    """
+    check_pending_jobs(len(specs))
+    
+    rows = []
+    for spec in specs:
+        scheduled_time = spec["scheduled_time"]
+        is_recurring = spec.get("is_recurring", False)
+        rows.append((
+            spec["contact"],
+            spec.get("reminder_message") or "这是您之前设置的提醒消息：" + spec["message"],
+            scheduled_time.strftime("%Y-%m-%d %H:%M:%S"),
+            is_recurring,
+            spec.get("recurring_type"),
+            spec.get("recurring_value"),
+            scheduled_time.strftime("%Y-%m-%d %H:%M:%S") if is_recurring else None,
+            spec.get("task_type"),
+            spec.get("task_params")
+        ))
+    
+    task_ids = db.add_scheduled_tasks_bulk(rows)
+    
+    # 暂停期间添加任务不会逐个唤醒调度线程，恢复时统一计算下一次唤醒时间
+    paused = scheduler.state == STATE_RUNNING
+    if paused:
+        scheduler.pause()
+    try:
+        for task_id, spec, row in zip(task_ids, specs, rows):
+            schedule_task_job(task_id, row[0], row[1], spec["scheduled_time"], row[3], row[4], row[5])
+    finally:
+        if paused:
+            scheduler.resume()
+    
+    logger.info("已批量创建 %d 个定时任务", len(task_ids))
+    return [(task_id, spec["scheduled_time"]) for task_id, spec in zip(task_ids, specs)]
+
+# 将任务创建函数添加到config对象中，以便ReminderAgent可以使用；config在进程内只创建一次，设置一次即可
+config.create_scheduled_task = create_scheduled_task
+config.create_scheduled_tasks_bulk = create_scheduled_tasks_bulk
+
 # 自动任务执行
 def execute_agent_task(task_type, params, contact):
     """
@@ -1655,18 +2717,17 @@ def execute_agent_task(task_type, params, contact):
     - calculate: 计算或转换
     - translate: 翻译
     """
-    logger.info(f"[message_ai_service] 开始执行任务: {task_type}, 参数: {params}, 联系人: {contact}")
-    
-    # 将create_scheduled_task函数添加到config对象中，以便ReminderAgent可以使用
-    config.create_scheduled_task = create_scheduled_task
-    logger.info(f"[message_ai_service] 已将create_scheduled_task函数添加到config对象中")
+    logger.info("[message_ai_service] 开始执行任务: %s, 参数: %s, 联系人: %s", task_type, params, contact)
     
-    # 使用agents模块中的execute_agent_task函数
-    from agents.agent_base import execute_agent_task as agent_execute_task
-    logger.info(f"[message_ai_service] 已导入agents.agent_base中的execute_agent_task函数")
-    
-    result = agent_execute_task(task_type, params, contact, config)
-    logger.info(f"[message_ai_service] 任务执行结果: {result}")
+    # 使用agents模块中的execute_agent_task函数（模块顶部以别名导入），执行期间下游可从CURRENT_CONTACT读取联系人
+    token = CURRENT_CONTACT.set(contact)
+    try:
+        result = agent_execute_task(task_type, params, contact, config)
+    finally:
+        CURRENT_CONTACT.reset(token)
+    # 新闻、搜索等结果可能有数KB，INFO级别只记录长度，完整内容在DEBUG级别输出
+    logger.info("[message_ai_service] 任务执行完成，结果长度: %d", len(result) if result else 0)
+    logger.debug("[message_ai_service] 任务执行结果: %s", result)
     return result
 
 # 识别并执行自动任务
@@ -1674,36 +2735,63 @@ def detect_and_execute_agent_task(message, contact):
     """
     识别并执行自动任务
     """
-    logger.info(f"[message_ai_service] 开始识别并执行自动任务: {message}, 联系人: {contact}")
+    logger.info("[message_ai_service] 开始识别并执行自动任务: %s, 联系人: %s", message, contact)
+    
+    # 使用agents模块中的detect_and_execute_agent_task函数（模块顶部以别名导入），执行期间下游可从CURRENT_CONTACT读取联系人
+    token = CURRENT_CONTACT.set(contact)
+    try:
+        result = agent_detect_and_execute(message, contact, config)
+    finally:
+        CURRENT_CONTACT.reset(token)
+    # 新闻、搜索等结果可能有数KB，INFO级别只记录长度，完整内容在DEBUG级别输出
+    logger.info("[message_ai_service] 任务执行完成，结果长度: %d", len(result) if result else 0)
+    logger.debug("[message_ai_service] 任务执行结果: %s", result)
+    return result
+
+# 关闭服务时等待发送队列中剩余回复的最长时间（秒）
+SHUTDOWN_TIMEOUT = 10
+
+_shutdown_done = False
+
+def shutdown_service():
+    """
+    关闭服务：停止接收新消息和新的定时任务，发送完已排队的回复后关闭数据库，整个过程共用一个时限；重复调用时只执行一次
+    """
+    global _shutdown_done
+    if _shutdown_done:
+        return
+    _shutdown_done = True
     
-    # 将create_scheduled_task函数添加到config对象中，以便ReminderAgent可以使用
-    config.create_scheduled_task = create_scheduled_task
-    logger.info(f"[message_ai_service] 已将create_scheduled_task函数添加到config对象中")
+    # 停止接收新消息，丢弃尚未开始处理的消息
+    reader.stop()
+    for worker in _message_workers:
+        worker.shutdown(wait=False, cancel_futures=True)
+    # 关闭调度器，不等待正在执行的任务，避免慢请求拖长退出时间
+    scheduler.shutdown(wait=False)
+    logger.info("调度器已关闭")
     
-    # 使用agents模块中的detect_and_execute_agent_task函数
-    from agents.agent_base import detect_and_execute_agent_task as agent_detect_and_execute
-    logger.info(f"[message_ai_service] 已导入agents.agent_base中的detect_and_execute_agent_task函数")
+    # 在限定时间内发送完已排队的回复
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    while _outbox.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if _outbox.unfinished_tasks:
+        logger.warning(f"关闭超时，{_outbox.unfinished_tasks} 条回复未发送")
     
-    result = agent_detect_and_execute(message, contact, config)
-    logger.info(f"[message_ai_service] 任务执行结果: {result}")
-    return result
+    # 用剩余的时间写完队列中的数据并关闭数据库连接，仍在使用中的连接不等待
+    db.close(timeout=max(0, deadline - time.monotonic()))
+    logger.info("服务已关闭")
 
 if __name__ == '__main__':
-    # 启动消息监控线程
-    monitor_thread = threading.Thread(target=start_message_monitor, daemon=True)
-    monitor_thread.start()
+    # 启动消息监控
+    start_message_monitor()
     
-    # 启动自动清理数据线程
-    cleanup_thread = threading.Thread(target=auto_cleanup_data, daemon=True)
-    cleanup_thread.start()
+    # 正常退出、Ctrl+C和SIGTERM都经由解释器退出流程执行同一个关闭函数
+    atexit.register(shutdown_service)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
     try:
         # 启动WebSocket服务
         logger.info("启动Web服务...")
         socketio.run(app, host='0.0.0.0', port=8888, debug=False)
     except KeyboardInterrupt:
-        logger.info("正在关闭服务...")
-    finally:
-        # 关闭调度器
-        scheduler.shutdown()
-        logger.info("调度器已关闭") 
\ No newline at end of file
+        logger.info("正在关闭服务...") 
\ No newline at end of file